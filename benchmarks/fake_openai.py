@@ -0,0 +1,377 @@
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class State:
+
+    def __init__(self, latency=0.0, run_time=0.0, answer_size=0, rate_limit=0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.request_times = []
+        self.run_time = run_time
+        self.answer_size = answer_size
+        self.lock = threading.Lock()
+        self.assistants = []
+        self.files = []
+        self.threads = {}
+        self.runs = {}
+        self.uploads = {}
+        self.counts = {}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def throttle(self):
+        if not self.rate_limit:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            self.request_times = [t for t in self.request_times if now - t < 1.0]
+            if len(self.request_times) >= self.rate_limit:
+                return 1.0 - (now - self.request_times[0])
+            self.request_times.append(now)
+            return None
+
+def _id(prefix):
+    return f'{prefix}_{uuid.uuid4().hex[:24]}'
+
+def _page(items, query):
+    order = query.get('order', ['desc'])[0]
+    limit = int(query.get('limit', ['20'])[0])
+    after = query.get('after', [None])[0]
+    before = query.get('before', [None])[0]
+    items = list(items) if order == 'asc' else list(reversed(items))
+    ids = [i['id'] for i in items]
+    if after in ids:
+        items = items[ids.index(after) + 1:]
+    if before in ids:
+        items = items[:ids.index(before)]
+    page = items[:limit]
+    return {
+        'object': 'list',
+        'data': page,
+        'first_id': page[0]['id'] if page else None,
+        'last_id': page[-1]['id'] if page else None,
+        'has_more': len(items) > limit
+    }
+
+def _message(thread_id, role, text, run_id=None, assistant_id=None, annotations=None):
+    return {
+        'id': _id('msg'), 'object': 'thread.message', 'created_at': int(time.time()),
+        'thread_id': thread_id, 'role': role, 'status': 'completed',
+        'content': [{'type': 'text', 'text': {'value': text, 'annotations': annotations or []}}],
+        'file_ids': [], 'assistant_id': assistant_id, 'run_id': run_id, 'metadata': {}
+    }
+
+def _answer(state, text):
+    answer = f'Echo: {text}'
+    if state.answer_size > len(answer):
+        answer += ' ' + 'lorem ipsum ' * ((state.answer_size - len(answer)) // 12)
+    return answer
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Type', '').startswith('application/json') and data:
+            return json.loads(data)
+        return data
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _sse_start(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _sse(self, event, data):
+        chunk = (f'event: {event}\n' if event else '') + f'data: {data if isinstance(data, str) else json.dumps(data)}\n\n'
+        raw = chunk.encode()
+        self.wfile.write(f'{len(raw):x}\r\n'.encode() + raw + b'\r\n')
+        self.wfile.flush()
+
+    def _sse_end(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _route(self, method):
+        state = self.state
+        url = urlparse(self.path)
+        path = re.sub(r'^/v1', '', url.path)
+        query = parse_qs(url.query)
+        state.count(f'{method} {re.sub(r"/[a-z]+_[0-9a-f]+", "/{id}", path)}')
+        if state.latency:
+            time.sleep(state.latency)
+        body = self._body() if method == 'POST' else None
+        retry_after = state.throttle()
+        if retry_after is not None:
+            state.count('429')
+            return self._send(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}}, {'retry-after-ms': str(int(retry_after * 1000) + 1)})
+
+        if path == '/assistants' and method == 'GET':
+            return self._send(200, _page(state.assistants, query))
+        if path == '/assistants' and method == 'POST':
+            assistant = {'id': _id('asst'), 'object': 'assistant', 'created_at': int(time.time()), 'description': None, 'metadata': {}}
+            assistant.update({k: body.get(k) for k in ['name', 'instructions', 'model', 'tools', 'file_ids', 'metadata'] if k in body})
+            assistant.setdefault('tools', [])
+            assistant.setdefault('file_ids', [])
+            state.assistants.append(assistant)
+            return self._send(200, assistant)
+        m = re.fullmatch(r'/assistants/([^/]+)', path)
+        if m:
+            found = [a for a in state.assistants if a['id'] == m[1]]
+            if not found:
+                return self._send(404, {'error': {'message': 'No assistant', 'type': 'invalid_request_error'}})
+            if method == 'DELETE':
+                state.assistants.remove(found[0])
+                return self._send(200, {'id': m[1], 'object': 'assistant.deleted', 'deleted': True})
+            if method == 'POST':
+                found[0].update(body)
+            return self._send(200, found[0])
+
+        if path == '/files' and method == 'GET':
+            purpose = query.get('purpose', [None])[0]
+            files = [f for f in state.files if purpose is None or f['purpose'] == purpose]
+            return self._send(200, {'object': 'list', 'data': files, 'has_more': False})
+        if path == '/files' and method == 'POST':
+            m = re.search(rb'filename="([^"]*)"', body)
+            file = {'id': _id('file'), 'object': 'file', 'bytes': len(body), 'created_at': int(time.time()),
+                    'filename': m[1].decode() if m else 'upload', 'purpose': 'assistants', 'status': 'processed'}
+            state.files.append(file)
+            return self._send(200, file)
+        m = re.fullmatch(r'/files/([^/]+)', path)
+        if m:
+            found = [f for f in state.files if f['id'] == m[1]]
+            if not found:
+                return self._send(404, {'error': {'message': 'No file', 'type': 'invalid_request_error'}})
+            if method == 'DELETE':
+                state.files.remove(found[0])
+                return self._send(200, {'id': m[1], 'object': 'file', 'deleted': True})
+            return self._send(200, found[0])
+
+        if path == '/uploads' and method == 'POST':
+            upload = {'id': _id('upload'), 'object': 'upload', 'created_at': int(time.time()), 'status': 'pending', 'file': None,
+                      'filename': body['filename'], 'purpose': body['purpose'], 'bytes': body['bytes'], '_parts': {}}
+            state.uploads[upload['id']] = upload
+            return self._send(200, {k: v for k, v in upload.items() if not k.startswith('_')})
+        m = re.fullmatch(r'/uploads/([^/]+)/(parts|complete|cancel)', path)
+        if m and method == 'POST':
+            upload = state.uploads[m[1]]
+            if m[2] == 'parts':
+                part = {'id': _id('part'), 'object': 'upload.part', 'created_at': int(time.time()), 'upload_id': upload['id']}
+                upload['_parts'][part['id']] = len(body)
+                return self._send(200, part)
+            if m[2] == 'complete':
+                file = {'id': _id('file'), 'object': 'file', 'bytes': sum(upload['_parts'][i] for i in body['part_ids']), 'created_at': int(time.time()),
+                        'filename': upload['filename'], 'purpose': upload['purpose'], 'status': 'processed'}
+                state.files.append(file)
+                upload.update(status='completed', file=file)
+            else:
+                upload['status'] = 'cancelled'
+            return self._send(200, {k: v for k, v in upload.items() if not k.startswith('_')})
+
+        if path == '/threads' and method == 'POST':
+            thread = {'id': _id('thread'), 'object': 'thread', 'created_at': int(time.time()), 'metadata': {}}
+            state.threads[thread['id']] = {'thread': thread, 'messages': []}
+            return self._send(200, thread)
+        m = re.fullmatch(r'/threads/([^/]+)/messages', path)
+        if m:
+            thread = state.threads[m[1]]
+            if method == 'POST':
+                message = _message(m[1], body['role'], body['content'])
+                thread['messages'].append(message)
+                return self._send(200, message)
+            return self._send(200, _page(thread['messages'], query))
+        m = re.fullmatch(r'/threads/([^/]+)/runs', path)
+        if m and method == 'POST':
+            return self._create_run(m[1], body)
+        m = re.fullmatch(r'/threads/([^/]+)/runs/([^/]+)(/cancel|/submit_tool_outputs)?', path)
+        if m:
+            run = state.runs[m[2]]
+            if m[3] == '/cancel':
+                run['status'] = 'cancelled'
+            elif m[3] == '/submit_tool_outputs':
+                run['tool_outputs'] = body.get('tool_outputs')
+                run['status'] = 'in_progress'
+                run['required_action'] = None
+                self._finish_run(run, ' '.join(o.get('output', '') for o in body.get('tool_outputs', [])))
+                if body.get('stream'):
+                    return self._stream_run(run)
+            else:
+                self._advance(run)
+            return self._send(200, {k: v for k, v in run.items() if not k.startswith('_') and k != 'tool_outputs'})
+
+        if path == '/chat/completions' and method == 'POST':
+            return self._chat(body)
+
+        return self._send(404, {'error': {'message': f'Unknown route {method} {path}', 'type': 'invalid_request_error'}})
+
+    def _create_run(self, thread_id, body):
+        state = self.state
+        run = {'id': _id('run'), 'object': 'thread.run', 'created_at': int(time.time()), 'thread_id': thread_id,
+               'assistant_id': body['assistant_id'], 'status': 'queued', 'required_action': None, 'last_error': None,
+               'expires_at': None, 'started_at': None, 'cancelled_at': None, 'failed_at': None, 'completed_at': None,
+               'model': 'fake', 'instructions': '', 'tools': [], 'file_ids': [], 'metadata': {}, 'usage': None,
+               '_deadline': time.time() + state.run_time}
+        state.runs[run['id']] = run
+        messages = state.threads[thread_id]['messages']
+        user_text = messages[-1]['content'][0]['text']['value'] if messages else ''
+        assistant = next((a for a in state.assistants if a['id'] == body['assistant_id']), {})
+        functions = [t['function']['name'] for t in assistant.get('tools', []) if t.get('type') == 'function']
+        if functions and user_text.startswith('call '):
+            run['_pending_tools'] = [{'id': _id('call'), 'type': 'function', 'function': {'name': name, 'arguments': json.dumps({'text': user_text})}} for name in functions]
+        else:
+            run['_text'] = _answer(state, user_text)
+        if body.get('stream'):
+            return self._stream_run(run)
+        return self._send(200, {k: v for k, v in run.items() if not k.startswith('_')})
+
+    def _finish_run(self, run, text):
+        run['_text'] = f'Tools said: {text}'
+        run.pop('_pending_tools', None)
+
+    def _advance(self, run):
+        if run['status'] in ['queued', 'in_progress'] and time.time() >= run['_deadline']:
+            if run.get('_pending_tools'):
+                run['status'] = 'requires_action'
+                run['required_action'] = {'type': 'submit_tool_outputs', 'submit_tool_outputs': {'tool_calls': run['_pending_tools']}}
+            else:
+                self._complete(run)
+        elif run['status'] == 'queued':
+            run['status'] = 'in_progress'
+
+    def _complete(self, run):
+        state = self.state
+        file_id = state.files[0]['id'] if state.files else None
+        annotations = []
+        text = run['_text']
+        if file_id:
+            text += ' 【1†source】'
+            annotations = [{'type': 'file_citation', 'text': '【1†source】', 'start_index': len(text) - 10, 'end_index': len(text),
+                            'file_citation': {'file_id': file_id, 'quote': 'quoted text'}}]
+        message = _message(run['thread_id'], 'assistant', text, run_id=run['id'], assistant_id=run['assistant_id'], annotations=annotations)
+        state.threads[run['thread_id']]['messages'].append(message)
+        run['status'] = 'completed'
+        run['completed_at'] = int(time.time())
+        return message
+
+    def _stream_run(self, run):
+        public = lambda: {k: v for k, v in run.items() if not k.startswith('_') and k != 'tool_outputs'}
+        self._sse_start()
+        self._sse('thread.run.created', public())
+        run['status'] = 'in_progress'
+        self._sse('thread.run.in_progress', public())
+        delay = max(0.0, run['_deadline'] - time.time())
+        time.sleep(delay)
+        if run['status'] == 'cancelled':
+            self._sse('thread.run.cancelled', public())
+        elif run.get('_pending_tools'):
+            run['status'] = 'requires_action'
+            run['required_action'] = {'type': 'submit_tool_outputs', 'submit_tool_outputs': {'tool_calls': run['_pending_tools']}}
+            self._sse('thread.run.requires_action', public())
+        else:
+            message = self._complete(run)
+            created = dict(message, status='in_progress', content=[])
+            self._sse('thread.message.created', created)
+            text = message['content'][0]['text']['value']
+            for i in range(0, len(text), 16):
+                delta = {'index': 0, 'type': 'text', 'text': {'value': text[i:i + 16]}}
+                self._sse('thread.message.delta', {'id': message['id'], 'object': 'thread.message.delta', 'delta': {'content': [delta]}})
+            self._sse('thread.message.completed', message)
+            self._sse('thread.run.completed', public())
+        self._sse('done', '[DONE]')
+        self._sse_end()
+
+    def _chat(self, body):
+        state = self.state
+        user_text = body['messages'][-1]['content'] if body['messages'] else ''
+        text = _answer(state, user_text)
+        if state.run_time:
+            time.sleep(state.run_time)
+        base = {'id': _id('chatcmpl'), 'created': int(time.time()), 'model': body.get('model') or 'fake'}
+        if body.get('stream'):
+            self._sse_start()
+            for i in range(0, len(text), 16):
+                delta = {'content': text[i:i + 16]}
+                if i == 0:
+                    delta['role'] = 'assistant'
+                self._sse(None, dict(base, object='chat.completion.chunk', choices=[{'index': 0, 'delta': delta, 'finish_reason': None}]))
+            self._sse(None, dict(base, object='chat.completion.chunk', choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+            self._sse(None, '[DONE]')
+            return self._sse_end()
+        return self._send(200, dict(base, object='chat.completion', choices=[{'index': 0, 'finish_reason': 'stop',
+                          'message': {'role': 'assistant', 'content': text}}], usage={'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}))
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_DELETE(self):
+        self._route('DELETE')
+
+_topics = ['travel', 'cooking', 'tax', 'python', 'gardening', 'music', 'fitness', 'history', 'chemistry', 'law']
+
+def seed_assistants(state, count, instructions_size=200):
+    with state.lock:
+        state.assistants = []
+        for i in range(count):
+            topic = _topics[i % len(_topics)]
+            instructions = f'You are an expert in {topic}. ' * max(instructions_size // (len(topic) + 20), 1)
+            state.assistants.append({'id': _id('asst'), 'object': 'assistant', 'created_at': int(time.time()), 'name': f'{topic} helper {i}',
+                                     'description': None, 'instructions': instructions, 'model': 'fake', 'tools': [], 'file_ids': [], 'metadata': {}})
+
+def seed_messages(state, thread_id, count, text_size=200):
+    with state.lock:
+        messages = state.threads[thread_id]['messages']
+        for i in range(count):
+            role = 'user' if i % 2 == 0 else 'assistant'
+            messages.append(_message(thread_id, role, f'message {i} ' + 'lorem ipsum ' * (text_size // 12)))
+
+def serve(port=0, latency=0.0, run_time=0.0, answer_size=0, rate_limit=0):
+    Handler.state = State(latency=latency, run_time=run_time, answer_size=answer_size, rate_limit=rate_limit)
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    return server
+
+def start(**kwargs):
+    server = serve(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local stand-in for the OpenAI API')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--run-time', type=float, default=0.0, help='seconds until a run or chat completion finishes')
+    parser.add_argument('--answer-size', type=int, default=0, help='minimum answer length in characters')
+    parser.add_argument('--rate-limit', type=int, default=0, help='requests per second before answering 429 (0: unlimited)')
+    parser.add_argument('--assistants', type=int, default=0, help='number of assistants to create')
+    parser.add_argument('--instructions-size', type=int, default=200, help='instructions length of created assistants')
+    args = parser.parse_args()
+    server = serve(args.port, args.latency, args.run_time, args.answer_size, args.rate_limit)
+    seed_assistants(Handler.state, args.assistants, args.instructions_size)
+    print(f'http://127.0.0.1:{server.server_address[1]}/v1', flush=True)
+    server.serve_forever()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+commands = [
+    ['--help'],
+    ['config', 'list'],
+    ['unselect'],
+    ['retrieve'],
+    ['daemon', 'status'],
+    ['assistant', '--help'],
+    ['file', '--help']
+]
+
+heavy_modules = ['openai', 'loguru', 'httpx', 'pydantic']
+
+_runner = 'import sys; from computer.main import main; sys.argv = ["computer"] + sys.argv[1:]; main()'
+
+def _environ(home):
+    environ = dict(os.environ)
+    environ.update({'HOME': home, 'COMPUTER_NO_DAEMON': '1', 'OPENAI_API_KEY': 'benchmark'})
+    return environ
+
+def _import_times(command, environ):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _runner] + command, env=environ, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'{" ".join(command)} exited with {result.returncode}:\n{result.stderr[-2000:]}')
+    times = {}
+    for line in result.stderr.splitlines():
+        m = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        if m and len(m[3]) == 1:
+            times[m[4]] = int(m[2])
+    return times
+
+def _wall_times(command, environ, repeat):
+    timer = 'import time, subprocess, sys; t = time.perf_counter(); subprocess.run(sys.argv[1:], capture_output=True); print(time.perf_counter() - t)'
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', timer, sys.executable, '-c', _runner] + command, env=environ, capture_output=True, text=True)
+        times.append(float(result.stdout))
+    return times
+
+def measure(repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as home:
+        environ = _environ(home)
+        for command in commands:
+            import_times = _import_times(command, environ)
+            wall_times = _wall_times(command, environ, repeat)
+            results[' '.join(command)] = {
+                'wall_ms': round(statistics.median(wall_times) * 1000, 1),
+                'import_ms': round(sum(import_times.values()) / 1000, 1),
+                'computer_ms': round(sum(t for m, t in import_times.items() if m.startswith('computer')) / 1000, 1),
+                'heavy_modules': [m for m in heavy_modules if m in import_times]
+            }
+    return results
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for command, result in results.items():
+        if command not in baseline:
+            continue
+        base = baseline[command]
+        if result['wall_ms'] > base['wall_ms'] * (1 + tolerance):
+            regressions.append(f'{command}: wall {base["wall_ms"]}ms -> {result["wall_ms"]}ms')
+        added = set(result['heavy_modules']) - set(base['heavy_modules'])
+        if added:
+            regressions.append(f'{command}: now imports {", ".join(sorted(added))}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='CLI startup benchmark')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='runs per command')
+    parser.add_argument('-o', '--output', help='write results to JSON file')
+    parser.add_argument('-b', '--baseline', help='compare with results in JSON file')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    results = measure(args.repeat)
+    for command, result in results.items():
+        heavy = ','.join(result['heavy_modules']) if result['heavy_modules'] else '-'
+        print(f'{command:20} wall {result["wall_ms"]:7.1f}ms  import {result["import_ms"]:7.1f}ms  computer {result["computer_ms"]:6.1f}ms  heavy {heavy}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
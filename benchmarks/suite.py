@@ -0,0 +1,166 @@
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import fake_openai
+import startup
+
+scenarios = ['startup', 'conversation', 'thread', 'assistant', 'upload']
+
+thread_lengths = [10, 100, 500]
+assistant_counts = [10, 100, 1000]
+
+_runner = startup._runner
+
+@contextlib.contextmanager
+def _home(server):
+    with tempfile.TemporaryDirectory() as home:
+        environ = dict(os.environ)
+        environ.update({
+            'HOME': home,
+            'COMPUTER_NO_DAEMON': '1',
+            'OPENAI_API_KEY': 'benchmark',
+            'OPENAI_BASE_URL': f'http://127.0.0.1:{server.server_address[1]}/v1',
+            'OPENAI_MODEL_NAME': 'fake'
+        })
+        yield (home, environ)
+
+def _run(command, environ, input=''):
+    started = perf_counter()
+    result = subprocess.run([sys.executable, '-c', _runner] + command, env=environ, input=input, capture_output=True, text=True)
+    elapsed = perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f'{" ".join(command)} exited with {result.returncode}:\n{result.stderr[-2000:]}')
+    return elapsed
+
+def _repeat(command, environ, repeat, before=None):
+    times = []
+    for _ in range(repeat):
+        if before:
+            before()
+        times.append(_run(command, environ))
+    return {'wall_ms': round(statistics.median(times) * 1000, 1)}
+
+def measure_startup(server, repeat):
+    return startup.measure(repeat)
+
+def measure_conversation(server, repeat):
+    fake_openai.seed_assistants(server.RequestHandlerClass.state, 20)
+    results = {}
+    with _home(server) as (home, environ):
+        results['talk'] = _repeat(['talk', '-a', 'travel helper 0', 'hello'], environ, repeat)
+        results['next'] = _repeat(['next', 'tell me more'], environ, repeat)
+        results['retrieve'] = _repeat(['retrieve'], environ, repeat)
+        results['talk chat completion'] = _repeat(['talk', '-a', 'no such assistant', 'hello'], environ, repeat)
+        results['next chat completion'] = _repeat(['next', 'tell me more'], environ, repeat)
+    return results
+
+def measure_thread(server, repeat):
+    state = server.RequestHandlerClass.state
+    fake_openai.seed_assistants(state, 20)
+    results = {}
+    for length in thread_lengths:
+        with _home(server) as (home, environ):
+            _run(['talk', '-a', 'travel helper 0', 'hello'], environ)
+            fake_openai.seed_messages(state, list(state.threads)[-1], length)
+            remove_cache = lambda: shutil.rmtree(f'{home}/.assistant/cache/threads', ignore_errors=True)
+            results[f'retrieve {length} cold'] = _repeat(['retrieve'], environ, repeat, before=remove_cache)
+            results[f'retrieve {length} warm'] = _repeat(['retrieve'], environ, repeat)
+            results[f'next {length}'] = _repeat(['next', 'tell me more'], environ, repeat)
+    return results
+
+def measure_assistant(server, repeat):
+    results = {}
+    for count in assistant_counts:
+        fake_openai.seed_assistants(server.RequestHandlerClass.state, count)
+        with _home(server) as (home, environ):
+            results[f'select {count} cold'] = _repeat(['--refresh', 'select', 'helper 7'], environ, repeat)
+            results[f'select {count} warm'] = _repeat(['select', 'helper 7'], environ, repeat)
+            results[f'assistant list {count}'] = _repeat(['assistant', 'list'], environ, repeat)
+    return results
+
+def measure_upload(server, repeat, count=50, size=64 * 1024, jobs=4):
+    times = []
+    with _home(server) as (home, environ), tempfile.TemporaryDirectory() as directory:
+        for r in range(repeat):
+            filepaths = []
+            for i in range(count):
+                filepath = f'{directory}/{r}-{i}.bin'
+                with open(filepath, 'wb') as f:
+                    f.write(os.urandom(size))
+                filepaths.append(filepath)
+            times.append(_run(['file', 'create', '-j', str(jobs)] + filepaths, environ))
+    elapsed = statistics.median(times)
+    return {
+        f'file create {count}x{size // 1024}KB': {
+            'wall_ms': round(elapsed * 1000, 1),
+            'files_per_s': round(count / elapsed, 1),
+            'mb_per_s': round(count * size / elapsed / 1024 / 1024, 2)
+        }
+    }
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for scenario, scenario_results in results.items():
+        if scenario not in baseline:
+            continue
+        if scenario == 'startup':
+            regressions += startup.compare(scenario_results, baseline[scenario], tolerance)
+            continue
+        for name, result in scenario_results.items():
+            if name not in baseline[scenario]:
+                continue
+            base = baseline[scenario][name]
+            if result['wall_ms'] > base['wall_ms'] * (1 + tolerance):
+                regressions.append(f'{scenario} {name}: wall {base["wall_ms"]}ms -> {result["wall_ms"]}ms')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='CLI benchmark against a local fake OpenAI server')
+    parser.add_argument('scenario', nargs='*', help=f'scenarios to run ({", ".join(scenarios)}; default: all)')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='runs per command')
+    parser.add_argument('-l', '--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('-r', '--run-time', type=float, default=0.0, help='seconds until a run or chat completion finishes')
+    parser.add_argument('-s', '--answer-size', type=int, default=0, help='minimum answer length in characters')
+    parser.add_argument('-o', '--output', help='write results to JSON file')
+    parser.add_argument('-b', '--baseline', help='compare with results in JSON file')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    args = parser.parse_args()
+    unknown = [s for s in args.scenario if s not in scenarios]
+    if unknown:
+        parser.error(f'unknown scenario: {", ".join(unknown)}')
+
+    server = fake_openai.start(latency=args.latency, run_time=args.run_time, answer_size=args.answer_size)
+    results = {}
+    try:
+        for scenario in args.scenario or scenarios:
+            results[scenario] = globals()[f'measure_{scenario}'](server, args.repeat)
+            for name, result in results[scenario].items():
+                extra = ''.join(f'  {key} {value}' for key, value in result.items() if key not in ['wall_ms', 'heavy_modules'])
+                print(f'{scenario:12} {name:28} wall {result["wall_ms"]:8.1f}ms{extra}')
+    finally:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import json
 import re
 import sys
-import openai
+import threading
+from time import monotonic, sleep
 
-from computer.environment import env, logger
-from computer.util import get_all_assistants, get_assistant_ids_from_names, get_file_ids_from_names
+from computer.client import call_with_retries, get_client
+from computer.environment import config, env, logger
+from computer.lazy import lazy_import
+from computer.tools import describe_function, register_functions
+from computer.util import get_all_assistants, get_assistant_id_index, get_assistant_ids_from_names, get_file_ids_from_names, update_assistant_cache
+
+openai = lazy_import('openai')
+
+_default_instructions = 'You are a professional assistant.'
+_managed_metadata = {'managed_by': 'computer'}
 
 def add_assistant_parsers(subparser):
     subcommand_parser = subparser.add_parser('assistant', help='assistant command')
     subcommand_subparser = subcommand_parser.add_subparsers(dest='subcommand', title='assistant subcommand', required=True)
     delete_parser = subcommand_subparser.add_parser('delete', help='delete assistants')
-    delete_parser.add_argument('name', help='assistant name')
+    delete_parser.add_argument('name', nargs='+', help='assistant names or patterns')
     delete_parser.add_argument('-s', '--strict', action='store_true', help='match name strictly')
+    delete_parser.add_argument('-r', '--regex', action='store_true', help='match names as regular expressions')
+    delete_parser.add_argument('-a', '--all', action='store_true', help='delete all matched assistants')
+    delete_parser.add_argument('-n', '--dry-run', action='store_true', help='show assistants to delete')
+    delete_parser.add_argument('-j', '--jobs', type=int, default=8, help='number of concurrent requests')
+    apply_parser = subcommand_subparser.add_parser('apply', help='create or update assistants from a YAML or JSON spec')
+    sync_parser = subcommand_subparser.add_parser('sync', help='apply a spec and delete assistants applied from a spec before but not in it')
+    for spec_parser in [apply_parser, sync_parser]:
+        spec_parser.add_argument('spec', help='spec file (.json, .yaml or .yml)')
+        spec_parser.add_argument('-n', '--dry-run', action='store_true', help='show changes without applying them')
+        spec_parser.add_argument('-j', '--jobs', type=int, default=8, help='number of concurrent requests')
     create_parser = subcommand_subparser.add_parser('create', help='create assistants')
-    create_parser.add_argument('-f', '--files', nargs='*', help='file names')
+    create_parser.add_argument('-f', '--files', nargs='*', default=[], help='file names')
     create_parser.add_argument('-i', '--instruction', help='instructions')
     create_parser.add_argument('-n', '--name', help='name')
+    create_parser.add_argument('-t', '--tools', nargs='*', default=[], metavar='MODULE:FUNCTION', help='local Python functions callable by the assistant')
     list_parser = subcommand_subparser.add_parser('list', help='list assistants')
     list_parser.add_argument('-L', '--long', action='store_true', help='long format')
     list_parser.add_argument('-S', '--separator', default=' ', help='output field separator')
@@ -25,7 +48,7 @@ def list_assistants(args):
     long = args.long
 
     assistants = get_all_assistants()
-    for assistant_data in assistants.data:
+    for assistant_data in assistants:
         id = assistant_data.id if assistant_data.id else 'None'
         name = assistant_data.name if assistant_data.name else 'None'
         model = assistant_data.model if assistant_data.model else 'None'
@@ -38,10 +61,14 @@ def list_assistants(args):
         else:
             print(separator.join([id, name]))
 
+def _assistant_tools(tool_specs):
+    return [{'type': 'retrieval'}] + [describe_function(spec) for spec in tool_specs]
+
 def create_assistant(args):
     name = args.name
     filenames = args.files
     instructions = args.instruction
+    tool_specs = args.tools
     file_purpose = 'assistants'
     separator = ' '
 
@@ -53,29 +80,240 @@ def create_assistant(args):
                     print(f'No files matched with {name}', file=sys.stderr)
             return
     else:
-        file_ids = openai._types.NotGiven
+        file_ids = openai.NOT_GIVEN
 
-    assistant = openai.beta.assistants.create(
+    try:
+        tools = _assistant_tools(tool_specs)
+    except (ImportError, AttributeError, ValueError) as e:
+        print(f'Failed to load tool: {e}', file=sys.stderr)
+        return
+
+    assistant = get_client().beta.assistants.create(
         name=name,
-        instructions=instructions if instructions is not None else 'You are a professional assistant.',
+        instructions=instructions if instructions is not None else _default_instructions,
         model = env.get('OPENAI_MODEL_NAME'),
-        tools=[{'type': 'retrieval'}],
+        tools=tools,
         file_ids=file_ids
     )
-    logger.debug(f'Create assistant object: {assistant}')
+    logger.debug('Create assistant object: {}', assistant)
+    update_assistant_cache(added=assistant)
+    register_functions(tool_specs)
 
     print(separator.join([assistant.id, assistant.name]))
 
+class _Throttle:
+
+    def __init__(self, jobs):
+        self._semaphore = threading.Semaphore(jobs)
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def pause(self, interval):
+        with self._lock:
+            self._resume_at = max(self._resume_at, monotonic() + interval)
+
+    def _wait(self):
+        while True:
+            with self._lock:
+                delay = self._resume_at - monotonic()
+            if delay <= 0:
+                return
+            sleep(delay)
+
+    @contextmanager
+    def slot(self):
+        with self._semaphore:
+            self._wait()
+            yield
+
+def _run_concurrently(operations, jobs):
+    throttle = _Throttle(max(jobs, 1))
+    retries = int(config.retrieve_float('assistant_retries', 5))
+    client = get_client().with_options(max_retries=0)
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        # create is not idempotent; a lost response may already have created the assistant
+        futures = {executor.submit(call_with_retries, f'{action} {name}', lambda function=function: function(client), retries, throttle, action != 'create'): (action, name) for (action, name, function) in operations}
+        for future in as_completed(futures):
+            (action, name) = futures[future]
+            try:
+                yield (action, name, future.result(), None)
+            except Exception as e:
+                yield (action, name, None, e)
+
+def _delete_operation(assistant):
+    return ('delete', assistant.name, lambda client: client.beta.assistants.delete(assistant.id))
+
+def _apply_results(operations, jobs):
+    separator = ' '
+    counts = dict.fromkeys(['create', 'update', 'delete', 'failed'], 0)
+    for (action, name, result, error) in _run_concurrently(operations, jobs):
+        if error is not None:
+            print(f'Failed to {action} {name}: {error}', file=sys.stderr)
+            counts['failed'] += 1
+            continue
+        logger.debug('{} assistant: {}', action.capitalize(), result)
+        if action == 'delete':
+            update_assistant_cache(removed_id=result.id)
+            print(separator.join([result.id, name]))
+        else:
+            update_assistant_cache(added=result)
+            print(separator.join([result.id, result.name]))
+        counts[action] += 1
+    return counts
+
 def delete_assistant(args):
-    name = args.name
+    names = args.name
     strict = args.strict
+    regex = args.regex
+    delete_all = args.all
+    dry_run = args.dry_run
+    jobs = args.jobs
 
-    matched_ids = get_assistant_ids_from_names([name], strict=strict)[0]
-    if len(matched_ids) > 1:
-        print(f'Ambiguous name: {name}', file=sys.stderr)
-    elif len(matched_ids) == 0:
-        print(f'No assistants matched with {name}', file=sys.stderr)
+    if regex:
+        try:
+            patterns = [re.compile(name) for name in names]
+        except re.error as e:
+            print(f'Invalid pattern: {e}', file=sys.stderr)
+            return
+        matched_ids = [[a.id for a in get_all_assistants() if a.name and pattern.search(a.name)] for pattern in patterns]
+        if any(len(name_ids) == 0 for name_ids in matched_ids):
+            matched_ids = [[a.id for a in get_all_assistants(refresh=True) if a.name and pattern.search(a.name)] for pattern in patterns]
     else:
-        id = matched_ids[0]
-        deleted = openai.beta.assistants.delete(id)
-        logger.debug(f'Delete assistant: {deleted}')
+        matched_ids = get_assistant_ids_from_names(names, strict=strict)
+
+    ids = []
+    for name, name_ids in zip(names, matched_ids):
+        if len(name_ids) > 1 and not delete_all:
+            print(f'Ambiguous name: {name}', file=sys.stderr)
+            return
+        elif len(name_ids) == 0:
+            print(f'No assistants matched with {name}', file=sys.stderr)
+        ids += [id for id in name_ids if id not in ids]
+
+    index = get_assistant_id_index()
+    assistants = [index.get(id) for id in ids]
+    if dry_run:
+        for assistant in assistants:
+            print(f'delete {assistant.id} {assistant.name}')
+        return
+
+    _apply_results([_delete_operation(assistant) for assistant in assistants], jobs)
+
+def _load_spec(path):
+    with open(path, 'r') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError('PyYAML is required to read YAML specs; install pyyaml or use JSON')
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    entries = spec.get('assistants', []) if isinstance(spec, dict) else spec
+    if not isinstance(entries, list) or not all(isinstance(entry, dict) and isinstance(entry.get('name'), str) for entry in entries):
+        raise ValueError('spec must be a list of assistants with names')
+    names = [entry['name'] for entry in entries]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if len(duplicates) > 0:
+        raise ValueError(f'duplicate names: {", ".join(duplicates)}')
+    return entries
+
+def _desired_assistant(entry):
+    filenames = entry.get('files') or []
+    file_ids = []
+    if len(filenames) > 0:
+        (file_ids, all_matched) = get_file_ids_from_names(filenames, purpose='assistants')
+        if all_matched is False:
+            unmatched = [filename for (id, filename) in zip(file_ids, filenames) if id is None]
+            raise ValueError(f'no files matched with {", ".join(unmatched)}')
+    return {
+        'name': entry['name'],
+        'instructions': entry.get('instructions', _default_instructions),
+        'model': entry.get('model', env.get('OPENAI_MODEL_NAME')),
+        'tools': _assistant_tools(entry.get('tools') or []),
+        'file_ids': file_ids,
+        'metadata': _managed_metadata
+    }
+
+def _tool_key(tool):
+    data = tool if isinstance(tool, dict) else tool.model_dump(exclude_none=True)
+    key = {'type': data['type']}
+    if data['type'] == 'function':
+        function = data['function'] if isinstance(data['function'], dict) else data['function'].model_dump(exclude_none=True)
+        key['function'] = {'name': function['name'], 'description': function.get('description') or '', 'parameters': function.get('parameters') or {}}
+    return json.dumps(key, sort_keys=True)
+
+def _assistant_changes(assistant, desired):
+    changes = {}
+    if assistant.instructions != desired['instructions']:
+        changes['instructions'] = desired['instructions']
+    if assistant.model != desired['model']:
+        changes['model'] = desired['model']
+    if sorted(_tool_key(t) for t in assistant.tools or []) != sorted(_tool_key(t) for t in desired['tools']):
+        changes['tools'] = desired['tools']
+    if sorted(assistant.file_ids or []) != sorted(desired['file_ids']):
+        changes['file_ids'] = desired['file_ids']
+    if not _is_managed(assistant):
+        changes['metadata'] = {**(assistant.metadata or {}), **desired['metadata']}
+    return changes
+
+def _is_managed(assistant):
+    metadata = assistant.metadata or {}
+    return all(metadata.get(key) == value for key, value in _managed_metadata.items())
+
+def _plan_spec(entries, prune):
+    assistants = get_all_assistants(refresh=True)
+    by_name = {}
+    for assistant in assistants:
+        by_name.setdefault(assistant.name, []).append(assistant)
+
+    operations = []
+    unchanged = 0
+    for entry in entries:
+        name = entry['name']
+        matched = by_name.get(name, [])
+        if len(matched) > 1:
+            raise ValueError(f'ambiguous name: {name} matches {len(matched)} assistants')
+        desired = _desired_assistant(entry)
+        if len(matched) == 0:
+            operations.append(('create', name, lambda client, desired=desired: client.beta.assistants.create(**desired)))
+            continue
+        changes = _assistant_changes(matched[0], desired)
+        if len(changes) == 0:
+            unchanged += 1
+            continue
+        id = matched[0].id
+        operations.append(('update', f'{name} ({", ".join(changes)})', lambda client, id=id, changes=changes: client.beta.assistants.update(id, **changes)))
+
+    if prune:
+        names = {entry['name'] for entry in entries}
+        operations += [_delete_operation(assistant) for assistant in assistants if assistant.name not in names and _is_managed(assistant)]
+    return (operations, unchanged)
+
+def _apply_spec(args, prune):
+    path = args.spec
+    dry_run = args.dry_run
+    jobs = args.jobs
+
+    try:
+        entries = _load_spec(path)
+        (operations, unchanged) = _plan_spec(entries, prune)
+    except (OSError, ValueError, ImportError, AttributeError) as e:
+        print(f'Failed to read spec {path}: {e}', file=sys.stderr)
+        return
+
+    if dry_run:
+        for (action, name, _) in operations:
+            print(f'{action} {name}')
+        print(f'{len(operations)} changes, {unchanged} unchanged', file=sys.stderr)
+        return
+
+    register_functions([spec for entry in entries for spec in entry.get('tools') or []])
+    counts = _apply_results(operations, jobs)
+    print(f'Created {counts["create"]}, updated {counts["update"]}, deleted {counts["delete"]}, unchanged {unchanged}, failed {counts["failed"]}', file=sys.stderr)
+
+def apply_assistants(args):
+    _apply_spec(args, prune=False)
+
+def sync_assistants(args):
+    _apply_spec(args, prune=True)
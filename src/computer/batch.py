@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import sys
+from time import perf_counter
+from computer.conversation import complete_chat_messages, select_assistant_by_pattern, talk_in_new_thread
+from computer.environment import env
+from computer.util import get_all_assistants
+
+def add_batch_parsers(subparser):
+    batch_parser = subparser.add_parser('batch', help='run prompts from JSONL concurrently')
+    batch_parser.add_argument('file', nargs='?', default='-', help='JSONL file of prompts (default: stdin)')
+    batch_parser.add_argument('-a', '--assistant', help='default assistant id or name')
+    batch_parser.add_argument('-j', '--jobs', type=int, default=4, help='number of concurrent prompts')
+    batch_parser.add_argument('-m', '--model', help='default model name')
+    batch_parser.add_argument('-o', '--output', help='output JSONL file (default: stdout)')
+    return batch_parser
+
+def _read_items(file):
+    items = []
+    lines = sys.stdin.read().splitlines() if file == '-' else open(file, 'r', encoding='utf-8').read().splitlines()
+    for line_number, line in enumerate(lines, start=1):
+        if len(line.strip()) == 0:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            print(f'Skip line {line_number}: {e}', file=sys.stderr)
+            continue
+        if isinstance(item, str):
+            item = { 'message': item }
+        if not item.get('message'):
+            print(f'Skip line {line_number}: no message', file=sys.stderr)
+            continue
+        item.setdefault('id', line_number)
+        items.append(item)
+    return items
+
+def _talk_with_assistant(assistant, model, user_message):
+    (thread_id, run, answer_messages) = talk_in_new_thread(assistant.id, user_message, model=model)
+    result = { 'assistant': assistant.name, 'assistant_id': assistant.id, 'thread_id': thread_id, 'status': run.status }
+    if run.status == 'completed':
+        result['answer'] = '\n'.join([m.content[0].text.value for m in answer_messages])
+    elif run.last_error:
+        result['error'] = f'{run.last_error.code}: {run.last_error.message}'
+    return result
+
+def _talk_by_chat_completion(model, user_message):
+    (_, answer) = complete_chat_messages(model, [{ 'role': 'user', 'content': user_message }])
+    return { 'model': model, 'status': 'completed', 'answer': answer }
+
+def _process(item, default_pattern, default_model):
+    started_at = perf_counter()
+    pattern = item.get('assistant', default_pattern)
+    model = item.get('model', default_model)
+    result = { 'id': item['id'], 'message': item['message'] }
+    try:
+        if pattern:
+            assistant = select_assistant_by_pattern(pattern)
+            if assistant is None:
+                raise ValueError(f'Assistant id or name is ambiguous or not matched: {pattern}')
+            result.update(_talk_with_assistant(assistant, model, item['message']))
+        else:
+            result.update(_talk_by_chat_completion(model if model else env.get('OPENAI_MODEL_NAME'), item['message']))
+    except Exception as e:
+        result.update({ 'status': 'error', 'error': str(e) })
+    result['latency'] = round(perf_counter() - started_at, 3)
+    return result
+
+def batch(args):
+    items = _read_items(args.file)
+    if args.assistant or any([item.get('assistant') for item in items]):
+        get_all_assistants()
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+
+    started_at = perf_counter()
+    failed_count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+            futures = [executor.submit(_process, item, args.assistant, args.model) for item in items]
+            for future in as_completed(futures):
+                result = future.result()
+                if result['status'] != 'completed':
+                    failed_count += 1
+                output.write(json.dumps(result, ensure_ascii=False) + '\n')
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = perf_counter() - started_at
+    print(f'Completed {len(items) - failed_count}/{len(items)} prompts in {elapsed:.1f}s', file=sys.stderr)
\ No newline at end of file
@@ -0,0 +1,49 @@
+import json
+import os
+import threading
+from computer.environment import env, logger
+
+class Cache:
+
+    def __init__(self, name):
+        self._path = f'{env.data_dir()}/cache/{name}.json'
+        self._data = None
+
+    def _load(self):
+        if self._data is None:
+            try:
+                with open(self._path, 'r') as f:
+                    self._data = json.load(f)
+            except Exception:
+                logger.debug('Failed to load cache from {}', self._path)
+                self._data = {}
+        return self._data
+
+    def save(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        temporary_path = f'{self._path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temporary_path, 'w') as f:
+                json.dump(self._load(), f, ensure_ascii=True)
+            os.replace(temporary_path, self._path)
+        except Exception:
+            logger.debug('Failed to save cache to {}', self._path)
+
+    def get(self, key):
+        return self._load().get(key)
+
+    def items(self):
+        return list(self._load().items())
+
+    def set(self, key, value):
+        self._load()[key] = value
+
+    def update(self, values):
+        self._load().update(values)
+
+    def remove(self, key):
+        self._load().pop(key, None)
+
+    def clear(self):
+        self._data = {}
+        self.save()
\ No newline at end of file
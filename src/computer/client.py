@@ -0,0 +1,127 @@
+from contextlib import nullcontext
+import importlib.util
+import os
+import random
+import threading
+from time import sleep
+
+from computer import trace
+from computer.environment import config, logger
+from computer.lazy import lazy_import
+
+httpx = lazy_import('httpx')
+openai = lazy_import('openai')
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+_retryable_status_codes = [408, 409, 429]
+_last_request = threading.local()
+
+def _http2_available():
+    return importlib.util.find_spec('h2') is not None
+
+def _client_settings():
+    return (
+        int(config.retrieve_float('http_max_connections', 100)),
+        int(config.retrieve_float('http_max_keepalive_connections', 20)),
+        config.retrieve_float('http_keepalive_expiry', 30.0),
+        config.retrieve_bool('http2', True) and _http2_available(),
+        config.retrieve_float('request_timeout', 600.0),
+        config.retrieve_float('connect_timeout', 5.0),
+        int(config.retrieve_float('max_retries', 2)),
+    )
+
+def _create_tracing_transport(transport):
+
+    class TracedStream(httpx.SyncByteStream):
+
+        def __init__(self, stream, span):
+            self._stream = stream
+            self._span = span
+
+        def __iter__(self):
+            for chunk in self._stream:
+                self._span.count(bytes_received=len(chunk))
+                yield chunk
+
+        def close(self):
+            try:
+                self._stream.close()
+            finally:
+                self._span.finish()
+
+    class TracingTransport(httpx.BaseTransport):
+
+        def handle_request(self, request):
+            if not trace.enabled():
+                return transport.handle_request(request)
+
+            target = (request.method, str(request.url))
+            retry = getattr(_last_request, 'failed', None) == target
+            span = trace.start_span(trace.request_name(request.method, request.url.path))
+            span.count(requests=1, retries=1 if retry else 0, bytes_sent=int(request.headers.get('content-length', 0)))
+            try:
+                response = transport.handle_request(request)
+            except Exception as e:
+                _last_request.failed = target
+                span.set(error=type(e).__name__)
+                span.finish()
+                raise
+            _last_request.failed = target if response.status_code in _retryable_status_codes or response.status_code >= 500 else None
+            span.set(status=response.status_code)
+            return httpx.Response(response.status_code, headers=response.headers, stream=TracedStream(response.stream, span), extensions=response.extensions)
+
+        def close(self):
+            transport.close()
+
+    return TracingTransport()
+
+def _create_client(settings):
+    (max_connections, max_keepalive_connections, keepalive_expiry, http2, request_timeout, connect_timeout, max_retries) = settings
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections, keepalive_expiry=keepalive_expiry)
+    timeout = httpx.Timeout(request_timeout, connect=connect_timeout)
+    transport = _create_tracing_transport(httpx.HTTPTransport(limits=limits, http2=http2))
+    http_client = httpx.Client(transport=transport, timeout=timeout, follow_redirects=True)
+    return openai.OpenAI(http_client=http_client, timeout=timeout, max_retries=max_retries)
+
+def _retry_after(response):
+    try:
+        if 'retry-after-ms' in response.headers:
+            return float(response.headers['retry-after-ms']) / 1000
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+def call_with_retries(description, function, retries, throttle=None, retry_connection_errors=True):
+    for attempt in range(retries + 1):
+        with throttle.slot() if throttle is not None else nullcontext():
+            try:
+                return function()
+            except (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError) as e:
+                if attempt == retries or (isinstance(e, openai.APIConnectionError) and not retry_connection_errors):
+                    raise
+                interval = (2 ** attempt) * random.uniform(0.5, 1.5)
+                paused = False
+                if isinstance(e, openai.RateLimitError):
+                    interval = _retry_after(e.response) or interval
+                    if throttle is not None:
+                        throttle.pause(interval)
+                        paused = True
+                logger.debug('Retry {} in {:.1f}s: {}', description, interval, e)
+        if not paused:
+            sleep(interval)
+
+def get_client():
+    global _client, _client_key
+
+    key = (_client_settings(), os.environ.get('OPENAI_API_KEY'), os.environ.get('OPENAI_BASE_URL'), os.environ.get('OPENAI_ORG_ID'))
+    with _client_lock:
+        if _client is None or _client_key != key:
+            if _client is not None:
+                _client.close()
+            with trace.span('create client'):
+                _client = _create_client(key[0])
+            _client_key = key
+            logger.debug('Create client: {}', key[0])
+        return _client
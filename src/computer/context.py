@@ -0,0 +1,93 @@
+import re
+from computer.client import get_client
+from computer.environment import config, env, logger
+from computer.trace import traced
+
+_message_overhead_tokens = 4
+
+_summary_template = '''
+Summarize the following conversation so that it can replace the original messages as context.
+Keep facts, names, numbers, decisions and open questions. Answer with the summary only.
+
+### Previous summary
+{summary}
+
+### Conversation
+{conversation}
+'''
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    wide_characters = len(re.findall(r'[⺀-鿿가-힯豈-﫿＀-￯]', text))
+    narrow_characters = len(text) - wide_characters
+    return wide_characters + (narrow_characters + 3) // 4
+
+def estimate_message_tokens(message):
+    return estimate_tokens(message['content']) + _message_overhead_tokens
+
+def _split_turns(messages):
+    turns = []
+    for message in messages:
+        if message['role'] == 'user' or len(turns) == 0:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+@traced('summarize context')
+def _summarize(model, summary, messages):
+    conversation = '\n'.join([f'{m["role"]}: {m["content"]}' for m in messages])
+    response = get_client().chat.completions.create(
+        model = model,
+        messages = [
+            { 'role': 'user', 'content': _summary_template.format(summary=summary if summary else 'None', conversation=conversation) }
+        ]
+    )
+    logger.debug('Summarize context: {}', response)
+    return response.choices[0].message.content
+
+def _summary_message(summary):
+    return { 'role': 'system', 'content': f'Summary of the earlier conversation:\n{summary}' }
+
+def _retrieve_summary(model, messages, dropped_count):
+    summary_profile = env.retrieve('summary')
+    if not summary_profile:
+        summary_profile = { 'summary': None, 'count': 0 }
+    if summary_profile['count'] > dropped_count:
+        summary_profile = { 'summary': None, 'count': 0 }
+
+    if summary_profile['count'] < dropped_count:
+        summary = _summarize(model, summary_profile['summary'], messages[summary_profile['count']:dropped_count])
+        summary_profile = { 'summary': summary, 'count': dropped_count }
+        env.store('summary', summary_profile)
+
+    return summary_profile['summary']
+
+@traced('build context')
+def build_context_messages(messages):
+    budget = config.retrieve_float('context_token_budget')
+    if budget is None:
+        return messages
+
+    turns = _split_turns(messages)
+    kept_turns = []
+    used_tokens = 0
+    for turn in reversed(turns):
+        turn_tokens = sum([estimate_message_tokens(m) for m in turn])
+        if len(kept_turns) > 0 and used_tokens + turn_tokens > budget:
+            break
+        kept_turns.insert(0, turn)
+        used_tokens += turn_tokens
+
+    kept_messages = [m for turn in kept_turns for m in turn]
+    dropped_count = len(messages) - len(kept_messages)
+    if dropped_count == 0:
+        return messages
+
+    summary_model = config.retrieve('context_summary_model')
+    logger.debug('Context: keep {} messages ({} tokens), drop {}', len(kept_messages), used_tokens, dropped_count)
+    if not summary_model:
+        return kept_messages
+
+    summary = _retrieve_summary(summary_model, messages, dropped_count)
+    return [_summary_message(summary)] + kept_messages
\ No newline at end of file
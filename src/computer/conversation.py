@@ -1,30 +1,79 @@
-from distutils.util import strtobool
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import random
 import re
+import signal
 import sys
-from time import sleep
-import openai
+import threading
+from time import monotonic, sleep
+from computer.client import get_client
+from computer.context import build_context_messages
 from computer.environment import config, env, logger
-from computer.util import get_all_assistants
+from computer.lazy import lazy_import
+from computer.response_cache import build_response_key, lookup_response, response_cache_enabled, store_response
+from computer.router import route_message, score_assistants
+from computer.tools import registered_functions, run_tool_calls
+from computer.trace import traced
+from computer.transcript import Transcript
+from computer.util import get_all_assistants, get_assistant_id_index, get_assistant_ids_from_names, get_assistant_index, get_filenames_from_ids, get_thread_messages
+
+openai = lazy_import('openai')
+
+_fan_out_policies = ['all', 'first', 'merge']
+
+_merge_template = '''
+Merge the following answers from different assistants into one answer to the question.
+Keep citation marks such as [1] next to the statements they support. Answer with the merged answer only.
+
+Question:
+{question}
+
+{answers}
+'''
 
 def add_conversation_parsers(subparser):
     next_parser = subparser.add_parser('next', help='next conversation')
     next_parser.add_argument('message', nargs='?', help='message to assistant')
     next_parser.add_argument('-a', '--assistant', help='assistant id or name')
     next_parser.add_argument('-m', '--model', help='model name')
+    next_parser.add_argument('-t', '--timeout', type=float, metavar='SECONDS', help='cancel the run after SECONDS')
     retrieve_parser = subparser.add_parser('retrieve', help='retrieve conversation')
     retrieve_parser.add_argument('-f', '--footnotes', action='store_true', help='print footnotes')
+    retrieve_parser.add_argument('-l', '--last', type=int, metavar='N', help='print the last N messages')
+    retrieve_parser.add_argument('-r', '--range', metavar='START:END', help='print messages #START to #END')
     select_parser = subparser.add_parser('select', help='select assistant')
     select_parser.add_argument('pattern', help='search pattern of assistants id or name')
     talk_parser = subparser.add_parser('talk', help='conversation with assistant')
     talk_parser.add_argument('message', nargs='?', help='message to assistant')
     talk_parser.add_argument('-a', '--assistant', help='assistant id or name')
     talk_parser.add_argument('-m', '--model', help='model name')
+    talk_parser.add_argument('-t', '--timeout', type=float, metavar='SECONDS', help='cancel the run after SECONDS')
+    talk_parser.add_argument('-F', '--fan-out', type=int, metavar='N', help='ask up to N matched assistants at once, each on a new thread')
+    talk_parser.add_argument('-P', '--policy', choices=_fan_out_policies, default='all', help='how to report fan-out answers')
     unselect_parser = subparser.add_parser('unselect', help='unselect assistant')
+    cancel_parser = subparser.add_parser('cancel', help='cancel the run in progress on the current thread')
+    session_parser = subparser.add_parser('session', help='session command')
+    session_subparser = session_parser.add_subparsers(dest='subcommand', title='session subcommand', required=True)
+    session_list_parser = session_subparser.add_parser('list', help='list sessions')
+    session_remove_parser = session_subparser.add_parser('remove', help='remove session')
+    session_remove_parser.add_argument('name', help='session name')
     return subparser
 
-def _select_assistant_by_pattern(pattern):
-    assistants = get_all_assistants()
-    matched_assistants = [a for a in assistants.data if re.search(pattern, f'{a.id}\r{a.name}')]
+def _match_assistants(pattern, refresh=False):
+    if re.search(r'[.^$*+?{}\[\]\\|()]', pattern) is None:
+        index = get_assistant_index(refresh=refresh)
+        id_index = get_assistant_id_index()
+        matched_ids = set(index.substring(pattern)) | set(id_index.substring(pattern))
+        return index.objects(matched_ids)
+    else:
+        assistants = get_all_assistants(refresh=refresh)
+        return [a for a in assistants if re.search(pattern, f'{a.id}\r{a.name}')]
+
+def select_assistant_by_pattern(pattern):
+    matched_assistants = _match_assistants(pattern)
+    if len(matched_assistants) == 0:
+        logger.debug('No assistant matched {}; refresh assistants', pattern)
+        matched_assistants = _match_assistants(pattern, refresh=True)
     return matched_assistants[0] if len(matched_assistants) == 1 else None
 
 _message_template = '''
@@ -41,13 +90,13 @@ Which assistant best answers the following question?
 '''
 
 def _select_assistant_name_by_chat_completions(auto_select_message):
-    response = openai.chat.completions.create(
+    response = get_client().chat.completions.create(
         model = config.retrieve('auto_select_model_name'),
         messages = [
             { 'role': 'user', 'content': auto_select_message }
         ]
     )
-    logger.debug(f'Auto select: {response}')
+    logger.debug('Auto select: {}', response)
 
     try:
         selected_assistant_name = response.choices[0].message.content
@@ -56,25 +105,36 @@ def _select_assistant_name_by_chat_completions(auto_select_message):
 
     return selected_assistant_name
 
-def _select_assistant_by_context(context):
+@traced('auto-select completion')
+def _select_assistant_by_chat_completions(context, assistants):
     original_chat_name = 'Chat completion'
     original_chat_instructions = 'Original ChatGPT chat completion'
-    assistants = get_all_assistants()
-    assistant_descriptions = [(a.name, a.instructions if a.instructions else '') for a in assistants.data if a.name]
+    assistant_descriptions = [(a.name, a.instructions if a.instructions else '') for a in assistants if a.name]
     assistant_descriptions.append((original_chat_name, original_chat_instructions))
     itemized_assistant_descriptions = '\n'.join([f'- Name: {name}\n  Description: {description}' for (name, description) in assistant_descriptions])
     auto_select_message = _message_template.format(context=context, itemized_assistant_descriptions=itemized_assistant_descriptions)
     selected_name = _select_assistant_name_by_chat_completions(auto_select_message)
-    for assistant_data in assistants.data:
+    for assistant_data in assistants:
         if selected_name == assistant_data.name:
+            return assistant_data.id
+    else:
+        return None
+
+@traced('route assistant')
+def _select_assistant_by_context(context):
+    assistants = get_all_assistants()
+    selected_id = route_message(context, assistants, lambda: _select_assistant_by_chat_completions(context, assistants))
+    for assistant_data in assistants:
+        if selected_id == assistant_data.id:
             return assistant_data
     else:
         return None
 
+@traced('select assistant')
 def _select_assistant(pattern, message=None):
     assistant_profile = env.retrieve('assistant')
     if pattern:
-        assistant = _select_assistant_by_pattern(pattern)
+        assistant = select_assistant_by_pattern(pattern)
         if not assistant:
             print('Assistant id or name is ambiguous or not matched with any ones', file=sys.stderr)
             assistant_profile = None
@@ -101,23 +161,40 @@ def _select_assistant(pattern, message=None):
 def _unselect_assistant():
     env.remove('assistant')
 
+@traced('create thread')
 def _start_thread():
-    thread = openai.beta.threads.create()
-    logger.debug(f'Create thread: {thread}')
+    thread = get_client().beta.threads.create()
+    logger.debug('Create thread: {}', thread)
     thread_profile = { 'type': 'thread', 'id': thread.id, 'messages': None }
     env.store('thread', thread_profile)
     print('New thread is created', file=sys.stderr)
     return thread_profile
 
 def _start_chat_completion():
-    thread_profile = { 'type': 'chat-completion', 'id': None, 'messages': [] }
+    _remove_transcript(env.retrieve('thread'))
+    thread_profile = { 'type': 'chat-completion', 'id': None, 'transcript': Transcript.create().id }
     env.store('thread', thread_profile)
+    env.remove('summary')
     print('New chat completion is created', file=sys.stderr)
     return thread_profile
 
 def _remove_thread():
+    _remove_transcript(env.retrieve('thread'))
     env.remove('thread')
 
+def _remove_transcript(thread_profile):
+    if thread_profile and thread_profile.get('transcript'):
+        Transcript(thread_profile['transcript']).remove()
+
+def _get_transcript(thread_profile):
+    if 'transcript' in thread_profile:
+        return Transcript(thread_profile['transcript'])
+    transcript = Transcript.create()
+    transcript.append(thread_profile.get('messages') or [])
+    env.store('thread', { 'type': 'chat-completion', 'id': None, 'transcript': transcript.id })
+    logger.debug('Move chat completion messages to transcript {}', transcript.id)
+    return transcript
+
 def _select_thread_and_assistant(pattern, user_message):
     thread_profile = env.retrieve('thread')
     assistant_profile = env.retrieve('assistant')
@@ -136,49 +213,45 @@ def select(args):
     if not assistant_profile:
         print('No assistant is selected', file=sys.stderr)
     else:
-        print(separator.join([assistant_profile.id, assistant_profile.name]))
+        print(separator.join([assistant_profile['id'], assistant_profile['name']]))
 
 def unselect(args):
     _unselect_assistant()
 
+def list_sessions(args):
+    for session in env.sessions():
+        print(session)
+
+def remove_session(args):
+    _remove_transcript(env.retrieve_from_session(args.name, 'thread'))
+    env.remove_session(args.name)
+
 def restart(args):
     _remove_thread()
     _unselect_assistant()
 
-def _print_thread_messages(thread_profile, start_message_id=None, print_footnotes=True):
+@traced('print messages')
+def _print_thread_messages(thread_profile, start_message_id=None, print_footnotes=True, message_range=None):
     thread_id = thread_profile['id']
-    thread_messages = openai.beta.threads.messages.list(thread_id)
-    logger.debug(f'List thread messages: {thread_messages}')
-
-    if start_message_id is None:
-        message_to_print = True
+    thread_messages = get_thread_messages(thread_id)
+
+    message_ids = [thread_message.id for thread_message in thread_messages]
+    start_index = message_ids.index(start_message_id) if start_message_id in message_ids else 0
+    stop_index = None
+    if message_range is not None:
+        (start_index, stop_index) = message_range(len(thread_messages))
+    messages_to_print = list(enumerate(thread_messages, start=1))[start_index:stop_index]
+
+    if print_footnotes is True:
+        file_ids = _cited_file_ids([thread_message for (_, thread_message) in messages_to_print])
+        filenames = get_filenames_from_ids(file_ids) if len(file_ids) > 0 else {}
     else:
-        message_to_print = False
+        filenames = {}
 
     message_separator = None
-    for message_index, thread_message in enumerate(reversed(thread_messages.data), start=1):
-        if message_to_print is False:
-            if thread_message.id == start_message_id:
-                message_to_print = True
-            else:
-                continue
-
-        answer = thread_message.content[0].text.value
+    for message_index, thread_message in messages_to_print:
+        (answer, footnotes) = _format_thread_message(thread_message, filenames, print_footnotes)
         role = thread_message.role
-        annotations = thread_message.content[0].text.annotations
-        footnotes = []
-        for note_index, annotation in enumerate(annotations, start=1):
-            note_mark = f'[{note_index}]'
-            file_id = annotation.file_citation.file_id
-            if file_id is None or len(file_id) == 0:
-                filename = 'missing'
-            else:
-                filename = openai.files.retrieve(file_id).filename
-            quote = annotation.file_citation.quote
-            footnotes.append(f'{note_mark} In {filename}.\n{quote}')
-            if annotation.text is not None and len(annotation.text) > 0:
-                answer = answer.replace(annotation.text, note_mark)
-
         message_string = f'#{message_index}:{role}: {answer}'
         footnotes_string = '\n'.join(footnotes)
 
@@ -187,42 +260,381 @@ def _print_thread_messages(thread_profile, start_message_id=None, print_footnote
         else:
             message_separator = '-' * 80
         print(message_string)
-        logger.debug('Message: ' + re.sub(r'\s', '_', message_string))
+        logger.opt(lazy=True).debug('Message: {}', lambda: re.sub(r'\s', '_', message_string))
         if len(footnotes_string) > 0:
-            if print_footnotes is True:
-                print('-' * 8 + '\n' + footnotes_string)
-                logger.debug('Footnotes: ' + re.sub(r'\s', '_', footnotes_string)[:80])
-
-def _talk_with_assistants(thread_profile, assistant_profile, user_message):
-    thread_id = thread_profile['id']
-    assistant_id = assistant_profile['id']
-
-    message = openai.beta.threads.messages.create(thread_id=thread_id, role="user", content=user_message)
-    logger.debug(f'Create message: {message}')
+            print('-' * 8 + '\n' + footnotes_string)
+            logger.opt(lazy=True).debug('Footnotes: {}', lambda: re.sub(r'\s', '_', footnotes_string)[:80])
+
+def _cited_file_ids(thread_messages):
+    return [annotation.file_citation.file_id for thread_message in thread_messages for annotation in thread_message.content[0].text.annotations if annotation.type == 'file_citation' and annotation.file_citation.file_id]
+
+def _format_thread_message(thread_message, filenames, print_footnotes=True, note_offset=0):
+    answer = thread_message.content[0].text.value
+    annotations = thread_message.content[0].text.annotations
+    footnotes = []
+    for note_index, annotation in enumerate(annotations, start=note_offset + 1):
+        note_mark = f'[{note_index}]'
+        if print_footnotes is True and annotation.type == 'file_citation':
+            filename = filenames.get(annotation.file_citation.file_id)
+            if filename is None:
+                filename = 'missing'
+            quote = annotation.file_citation.quote
+            footnotes.append(f'{note_mark} In {filename}.\n{quote}')
+        if annotation.text is not None and len(annotation.text) > 0:
+            answer = answer.replace(annotation.text, note_mark)
+    return (answer, footnotes)
+
+_run_active_statuses = ['queued', 'in_progress', 'requires_action', 'cancelling']
+
+def _poll_intervals(first=0.5, factor=1.5, jitter=0.2):
+    ceiling = config.retrieve_float('run_poll_interval_max', 10.0)
+    interval = min(first, ceiling)
+    while True:
+        yield interval * random.uniform(1.0 - jitter, 1.0 + jitter)
+        interval = min(interval * factor, ceiling)
+
+# BaseException so that the API client does not retry it as a connection error
+class _RunDeadline(BaseException):
+    pass
+
+def _interruption(e, timeout):
+    if isinstance(e, _RunDeadline):
+        return (f'Timed out after {timeout:g}s', 124)
+    return ('Interrupted', 130)
+
+@contextmanager
+def _run_deadline(timeout):
+    if timeout is None or timeout <= 0 or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise _RunDeadline()
+
+    previous_handler = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
 
-    run = openai.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
-    logger.debug(f'Create run: {run}')
+def _remember_run(run):
+    thread_profile = env.retrieve('thread')
+    if thread_profile and thread_profile['id'] == run.thread_id and thread_profile.get('run') != run.id:
+        env.store('thread', {**thread_profile, 'run': run.id})
 
-    status = 'in_progress'
-    while status in ['queued', 'in_progress', 'requires_action', 'cancelling']:
-        sleep(10)
-        result = openai.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
-        logger.debug(f'Retrieve run: {result}')
-        status = result.status
+def _forget_run(thread_id, run_id):
+    thread_profile = env.retrieve('thread')
+    if thread_profile and thread_profile['id'] == thread_id and thread_profile.get('run') == run_id:
+        env.store('thread', {k: v for k, v in thread_profile.items() if k != 'run'})
 
+def _cancel_run(thread_id, run_id):
+    try:
+        run = get_client().beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except openai.APIError as e:
+        logger.debug('Failed to cancel run {}: {}', run_id, e)
+        run = get_client().beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+    logger.debug('Cancel run: {}', run)
+    intervals = _poll_intervals(first=0.2)
+    started = monotonic()
+    while run.status in _run_active_statuses and monotonic() - started < config.retrieve_float('run_cancel_wait', 10.0):
+        sleep(next(intervals))
+        run = get_client().beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+    _forget_run(thread_id, run_id)
+    return run
+
+def _run_tool_calls(run):
+    tool_calls = run.required_action.submit_tool_outputs.tool_calls
+    print(f'Call {", ".join([tool_call.function.name for tool_call in tool_calls])}', file=sys.stderr)
+    return run_tool_calls(tool_calls, registered_functions())
+
+@traced('submit tool outputs')
+def _submit_tool_outputs(thread_id, run):
+    tool_outputs = _run_tool_calls(run)
+    run = get_client().beta.threads.runs.submit_tool_outputs(thread_id=thread_id, run_id=run.id, tool_outputs=tool_outputs)
+    logger.debug('Submit tool outputs: {}', run)
+    return run
+
+@traced('poll run')
+def _wait_for_run(thread_id, run):
+    intervals = _poll_intervals()
+    while run.status in _run_active_statuses:
+        if run.status == 'requires_action' and run.required_action is not None:
+            run = _submit_tool_outputs(thread_id, run)
+            continue
+        sleep(next(intervals))
+        run = get_client().beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+        logger.debug('Retrieve run: {}', run)
+    return run
+
+def _report_run_status(run):
+    status = run.status if run else None
     if status == 'cancelled':
         print('Cancelled by user', file=sys.stderr)
     elif status == 'failed':
-        print(f'Failed: {result.last_error.code}: {result.last_error.message}', file=sys.stderr)
+        print(f'Failed: {run.last_error.code}: {run.last_error.message}', file=sys.stderr)
     elif status == 'expired':
         print('Expired: Try again later', file=sys.stderr)
     else:
+        return True
+    return False
+
+def _create_run_stream_printer(message_index, message_separator=None):
+
+    class RunStreamPrinter(openai.AssistantEventHandler):
+
+        def __init__(self):
+            super().__init__()
+            self.message_index = message_index
+            self.message_separator = message_separator
+
+        def on_event(self, event):
+            if event.event == 'thread.run.created':
+                _remember_run(event.data)
+
+        def on_message_created(self, message):
+            if self.message_separator:
+                print(self.message_separator)
+            else:
+                self.message_separator = '-' * 80
+            self.message_index += 1
+            print(f'#{self.message_index}:{message.role}: ', end='', flush=True)
+
+        def on_text_delta(self, delta, snapshot):
+            text = delta.value if delta.value else ''
+            for annotation in delta.annotations if delta.annotations else []:
+                if annotation.text:
+                    text = text.replace(annotation.text, f'[{annotation.index + 1}]')
+            print(text, end='', flush=True)
+
+        def on_message_done(self, message):
+            print()
+            logger.debug('Stream message: {}', message)
+
+    return RunStreamPrinter()
+
+@traced('stream run')
+def _stream_run(thread_id, assistant_id, event_handler=None, message_index=0):
+    streaming_printer = event_handler is None
+    if streaming_printer:
+        event_handler = _create_run_stream_printer(message_index, '-' * 80 if message_index > 0 else None)
+    with get_client().beta.threads.runs.create_and_stream(thread_id=thread_id, assistant_id=assistant_id, event_handler=event_handler) as stream:
+        stream.until_done()
+        run = stream.current_run
+    logger.debug('Stream run: {}', run)
+    while streaming_printer and run is not None and run.status == 'requires_action' and run.required_action is not None:
+        tool_outputs = _run_tool_calls(run)
+        event_handler = _create_run_stream_printer(event_handler.message_index, event_handler.message_separator)
+        with get_client().beta.threads.runs.submit_tool_outputs_stream(thread_id=thread_id, run_id=run.id, tool_outputs=tool_outputs, event_handler=event_handler) as stream:
+            stream.until_done()
+            run = stream.current_run
+        logger.debug('Stream run: {}', run)
+    return run
+
+@traced('create message')
+def create_message(thread_id, user_message, role='user'):
+    message = get_client().beta.threads.messages.create(thread_id=thread_id, role=role, content=user_message)
+    logger.debug('Create message: {}', message)
+    return message
+
+@traced('run thread')
+def run_thread(thread_id, assistant_id, model=None):
+    run = get_client().beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, model=model if model else openai.NOT_GIVEN)
+    logger.debug('Create run: {}', run)
+    _remember_run(run)
+    return _wait_for_run(thread_id, run)
+
+@traced('chat completion')
+def complete_chat_messages(model, messages):
+    response = get_client().chat.completions.create(model=model, messages=messages)
+    logger.debug('Chat completion: {}', response)
+    return (response.choices[0].message.role, response.choices[0].message.content)
+
+@traced('list answers')
+def list_answer_messages(thread_id, message_id):
+    thread_messages = get_client().beta.threads.messages.list(thread_id, order='asc', after=message_id)
+    logger.debug('List thread messages: {}', thread_messages)
+    return [m for m in thread_messages.data if m.role == 'assistant' and len(m.content) > 0 and m.content[0].type == 'text']
+
+def _assistant_response_key(thread_id, assistant_id, user_message):
+    history = [[m.role, m.content[0].text.value] for m in get_thread_messages(thread_id) if len(m.content) > 0 and m.content[0].type == 'text']
+    return build_response_key(f'assistant:{assistant_id}', user_message, history)
+
+def _report_interrupted_run(thread_profile, message_id, reason, print_partial):
+    thread_id = thread_profile['id']
+    current_profile = env.retrieve('thread')
+    run_id = current_profile.get('run') if current_profile and current_profile['id'] == thread_id else None
+    if run_id is None:
+        print(f'{reason}: no run was started', file=sys.stderr)
+        return
+    run = _cancel_run(thread_id, run_id)
+    if print_partial:
+        _print_thread_messages(thread_profile, start_message_id=message_id, print_footnotes=False)
+    print(f'{reason}: run {run.id} is {run.status}', file=sys.stderr)
+
+def _talk_with_assistants(thread_profile, assistant_profile, user_message, timeout=None):
+    thread_id = thread_profile['id']
+    assistant_id = assistant_profile['id']
+
+    response_key = _assistant_response_key(thread_id, assistant_id, user_message) if response_cache_enabled() else None
+    if response_key is not None:
+        cached_answers = lookup_response(response_key)
+        if cached_answers is not None:
+            message = create_message(thread_id, user_message)
+            for (role, answer, *_) in cached_answers:
+                create_message(thread_id, answer, role=role)
+            _print_thread_messages(thread_profile, start_message_id=message.id, print_footnotes=False)
+            return
+
+    message = create_message(thread_id, user_message)
+
+    streaming = config.retrieve_bool('run_streaming', True)
+    try:
+        with _run_deadline(timeout):
+            if streaming:
+                message_index = len(get_thread_messages(thread_id))
+                print(f'#{message_index}:user: {user_message}')
+                run = _stream_run(thread_id, assistant_id, message_index=message_index)
+                if run is not None and run.status in _run_active_statuses:
+                    run = _wait_for_run(thread_id, run)
+            else:
+                run = run_thread(thread_id, assistant_id)
+    except (_RunDeadline, KeyboardInterrupt) as e:
+        if streaming:
+            print()
+        (reason, exit_code) = _interruption(e, timeout)
+        _report_interrupted_run(thread_profile, message.id, reason, print_partial=not streaming)
+        return exit_code
+    if run is not None:
+        _forget_run(thread_id, run.id)
+
+    succeeded = _report_run_status(run)
+    if not succeeded:
+        return 130 if run.status == 'cancelled' else 1
+    if not streaming:
         _print_thread_messages(thread_profile, start_message_id=message.id, print_footnotes=False)
 
-def _print_chat_completion_messages(thread_profile):
-    messages = thread_profile['messages']
+    if response_key is not None:
+        answer_messages = list_answer_messages(thread_id, message.id)
+        file_ids = _cited_file_ids(answer_messages)
+        filenames = get_filenames_from_ids(file_ids) if len(file_ids) > 0 else {}
+        answers = [[m.role, _format_thread_message(m, filenames, print_footnotes=False)[0]] for m in answer_messages]
+        store_response(response_key, answers)
+
+def _select_fan_out_assistants(pattern, user_message, count):
+    if pattern:
+        assistant_ids = get_assistant_ids_from_names([pattern])[0]
+    else:
+        assistant_ids = [id for (score, id) in score_assistants(user_message, get_all_assistants()) if score > 0]
+    index = get_assistant_id_index()
+    assistants = [index.get(id) for id in assistant_ids[:count]]
+    return [{ 'id': assistant.id, 'name': assistant.name } for assistant in assistants if assistant is not None]
+
+@traced('talk in new thread')
+def talk_in_new_thread(assistant_id, user_message, model=None, event_handler=None):
+    thread = get_client().beta.threads.create()
+    logger.debug('Create thread: {}', thread)
+    message = create_message(thread.id, user_message)
+    if event_handler is None:
+        run = run_thread(thread.id, assistant_id, model=model)
+    else:
+        run = _stream_run(thread.id, assistant_id, event_handler=event_handler)
+        if run is not None and run.status in _run_active_statuses:
+            run = _wait_for_run(thread.id, run)
+    if run is None or run.status != 'completed':
+        return (thread.id, run, [])
+    return (thread.id, run, list_answer_messages(thread.id, message.id))
+
+def _cancel_runs(event_handlers):
+    for event_handler in event_handlers:
+        run = event_handler.current_run
+        if run is not None and run.status in _run_active_statuses:
+            try:
+                get_client().beta.threads.runs.cancel(thread_id=run.thread_id, run_id=run.id)
+            except openai.APIError as e:
+                logger.debug('Failed to cancel run {}: {}', run.id, e)
+
+def _format_fan_out_answer(thread_messages, note_offset=0):
+    file_ids = _cited_file_ids(thread_messages)
+    filenames = get_filenames_from_ids(file_ids) if len(file_ids) > 0 else {}
+    (answers, footnotes) = ([], [])
+    for thread_message in thread_messages:
+        (answer, message_footnotes) = _format_thread_message(thread_message, filenames, note_offset=note_offset + len(footnotes))
+        answers.append(answer)
+        footnotes += message_footnotes
+    return ('\n'.join(answers), footnotes)
+
+def _print_answer(name, answer, footnotes):
+    print(f'{name}: {answer}')
+    if len(footnotes) > 0:
+        print('-' * 8 + '\n' + '\n'.join(footnotes))
+
+def _merge_answers(user_message, answers):
+    model = env.get('OPENAI_MODEL_NAME')
+    answers_string = '\n\n'.join([f'Answer from {name}:\n{answer}' for (name, answer, _) in answers])
+    merge_message = _merge_template.format(question=user_message, answers=answers_string)
+    (_, content) = complete_chat_messages(model, [{ 'role': 'user', 'content': merge_message }])
+    return content
+
+def _talk_with_fan_out(pattern, user_message, count, policy, timeout=None):
+    assistant_profiles = _select_fan_out_assistants(pattern, user_message, count)
+    if len(assistant_profiles) == 0:
+        print('No assistant is matched', file=sys.stderr)
+        return
+    print(f'Ask {", ".join([p["name"] for p in assistant_profiles])}', file=sys.stderr)
+
+    event_handlers = {p['id']: openai.AssistantEventHandler() for p in assistant_profiles}
+    answers = []
+    message_separator = None
+    executor = ThreadPoolExecutor(max_workers=len(assistant_profiles))
+    (interrupted, exit_code) = (None, None)
+    try:
+        with _run_deadline(timeout):
+            futures = {executor.submit(talk_in_new_thread, p['id'], user_message, event_handler=event_handlers[p['id']]): p for p in assistant_profiles}
+            for future in as_completed(futures):
+                assistant_profile = futures[future]
+                try:
+                    (_, run, thread_messages) = future.result()
+                except Exception as e:
+                    print(f'{assistant_profile["name"]}: {e}', file=sys.stderr)
+                    continue
+                if run is None or not _report_run_status(run) or len(thread_messages) == 0:
+                    continue
+
+                note_offset = sum([len(footnotes) for (_, _, footnotes) in answers]) if policy == 'merge' else 0
+                (answer, footnotes) = _format_fan_out_answer(thread_messages, note_offset)
+                answers.append((assistant_profile['name'], answer, footnotes))
+                if policy == 'merge':
+                    continue
+                if message_separator:
+                    print(message_separator)
+                else:
+                    message_separator = '-' * 80
+                _print_answer(assistant_profile['name'], answer, footnotes)
+                if policy == 'first':
+                    for f in futures:
+                        f.cancel()
+                    _cancel_runs(event_handlers.values())
+                    break
+    except (_RunDeadline, KeyboardInterrupt) as e:
+        (interrupted, exit_code) = _interruption(e, timeout)
+        _cancel_runs(event_handlers.values())
+        print(f'{interrupted}: cancelled unfinished runs', file=sys.stderr)
+    finally:
+        executor.shutdown(wait=policy != 'first' and interrupted is None, cancel_futures=True)
+
+    if policy == 'merge' and interrupted and len(answers) > 1:
+        for (name, answer, footnotes) in answers:
+            _print_answer(name, answer, footnotes)
+    elif policy == 'merge' and len(answers) > 0:
+        merged = answers[0][1] if len(answers) == 1 else _merge_answers(user_message, answers)
+        _print_answer(', '.join([name for (name, _, _) in answers]), merged, [f for (_, _, footnotes) in answers for f in footnotes])
+    return exit_code
+
+def _print_chat_completion_messages(messages, start_index=0):
     message_separator = None
-    for message_index, message in enumerate(messages, start=1):
+    for message_index, message in enumerate(messages, start=start_index + 1):
         role = message['role']
         content = message['content']
         message_string = f'#{message_index}:{role}: {content}'
@@ -232,33 +644,91 @@ def _print_chat_completion_messages(thread_profile):
         else:
             message_separator = '-' * 80
         print(message_string)
-        logger.debug('Message: ' + re.sub(r'\s', '_', message_string))
+        logger.opt(lazy=True).debug('Message: {}', lambda: re.sub(r'\s', '_', message_string))
+
+@traced('stream chat completion')
+def _stream_chat_completion(model, messages, message_index):
+    print('-' * 80)
+    print(f'#{message_index}:assistant: ', end='', flush=True)
+    response_role = 'assistant'
+    response_chunks = []
+    stream = get_client().chat.completions.create(model=model, messages=messages, stream=True)
+    for chunk in stream:
+        if len(chunk.choices) == 0:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.role:
+            response_role = delta.role
+        if delta.content:
+            response_chunks.append(delta.content)
+            print(delta.content, end='', flush=True)
+    print()
+    response_message = ''.join(response_chunks)
+    logger.opt(lazy=True).debug('Message: {}', lambda: re.sub(r'\s', '_', response_message))
+    return (response_role, response_message)
 
 def _talk_by_chat_completion(thread_profile, user_message):
-        messages = thread_profile['messages']
-        messages.append({ 'role': 'user', 'content': user_message })
-        model = env.get('OPENAI_MODEL_NAME')
-        response = openai.chat.completions.create(model=model, messages=messages)
-        logger.debug(response)
-        response_message = response.choices[0].message.content
-        response_role = response.choices[0].message.role
-        messages.append({'role': response_role, 'content': response_message})
-        thread_profile['messages'] = messages
-        env.store('thread', thread_profile)
-        _print_chat_completion_messages(thread_profile)
+    transcript = _get_transcript(thread_profile)
+    history = transcript.read()
+    user_turn = { 'role': 'user', 'content': user_message }
+    messages = history + [user_turn]
+    model = env.get('OPENAI_MODEL_NAME')
+    start_index = len(history)
+    response_key = build_response_key(f'model:{model}', user_message, history) if response_cache_enabled() else None
+    cached_turn = lookup_response(response_key) if response_key is not None else None
+    if cached_turn is not None:
+        transcript.append([user_turn, cached_turn])
+        _print_chat_completion_messages([user_turn, cached_turn], start_index=start_index)
+        return
+
+    context_messages = build_context_messages(messages)
+    if config.retrieve_bool('chat_completion_streaming', True):
+        _print_chat_completion_messages([user_turn], start_index=start_index)
+        (response_role, response_message) = _stream_chat_completion(model, context_messages, len(messages) + 1)
+        response_turn = {'role': response_role, 'content': response_message}
+        transcript.append([user_turn, response_turn])
+    else:
+        (response_role, response_message) = complete_chat_messages(model, context_messages)
+        response_turn = {'role': response_role, 'content': response_message}
+        transcript.append([user_turn, response_turn])
+        _print_chat_completion_messages([user_turn, response_turn], start_index=start_index)
+    if response_key is not None:
+        store_response(response_key, response_turn)
+
+def _parse_message_range(last, message_range):
+    if last is not None:
+        if last < 0:
+            raise ValueError(f'invalid number of messages: {last}')
+        return lambda count: (max(count - last, 0), count)
+    if message_range is None:
+        return None
+    m = re.fullmatch(r'(\d*)(:?)(\d*)', message_range)
+    if m is None or (m[2] == '' and m[1] == '') or (m[1] and int(m[1]) < 1):
+        raise ValueError(f'invalid range: {message_range}')
+    start = int(m[1]) - 1 if m[1] else 0
+    stop = int(m[3]) if m[3] else (None if m[2] else start + 1)
+    return lambda count: (min(start, count), count if stop is None else min(max(stop, start), count))
 
 def retrieve(args):
     print_footnotes = args.footnotes
 
+    try:
+        message_range = _parse_message_range(args.last, args.range)
+    except ValueError as e:
+        print(f'Failed to retrieve: {e}', file=sys.stderr)
+        return
+
     thread_profile = env.retrieve('thread')
     if thread_profile is None:
         print('No conversation history', file=sys.stderr)
     elif thread_profile['type'] == 'thread':
-        _print_thread_messages(thread_profile, print_footnotes=print_footnotes)
+        _print_thread_messages(thread_profile, print_footnotes=print_footnotes, message_range=message_range)
     else:
         if print_footnotes is True:
             print('Ignore print_footnotes option because messages are created by chat completion', file=sys.stderr)
-        _print_chat_completion_messages(thread_profile)
+        transcript = _get_transcript(thread_profile)
+        (start_index, stop_index) = message_range(len(transcript)) if message_range is not None else (0, None)
+        _print_chat_completion_messages(transcript.read(start_index, stop_index), start_index=start_index)
 
 def _talk(args):
     if args.model:
@@ -274,17 +744,36 @@ def _talk(args):
     else:
         pattern = None
 
+    timeout = args.timeout if args.timeout is not None else config.retrieve_float('run_timeout')
+
+    if getattr(args, 'fan_out', None):
+        return _talk_with_fan_out(pattern, user_message, args.fan_out, args.policy, timeout=timeout)
+
     _select_thread_and_assistant(pattern, user_message)
     thread_profile = env.retrieve('thread')
     assistant_profile = env.retrieve('assistant')
     if thread_profile['type'] == 'thread':
-        _talk_with_assistants(thread_profile, assistant_profile, user_message)
-    else:
-        _talk_by_chat_completion(thread_profile, user_message)
+        return _talk_with_assistants(thread_profile, assistant_profile, user_message, timeout=timeout)
+    try:
+        with _run_deadline(timeout):
+            _talk_by_chat_completion(thread_profile, user_message)
+    except _RunDeadline as e:
+        print()
+        (reason, exit_code) = _interruption(e, timeout)
+        print(reason, file=sys.stderr)
+        return exit_code
+
+def cancel(args):
+    thread_profile = env.retrieve('thread')
+    if not thread_profile or thread_profile['type'] != 'thread' or not thread_profile.get('run'):
+        print('No run is in progress', file=sys.stderr)
+        return
+    run = _cancel_run(thread_profile['id'], thread_profile['run'])
+    print(f'{run.id} {run.status}')
 
 def talk(args):
     _unselect_assistant()
-    _talk(args)
+    return _talk(args)
 
 def talk_next(args):
-    _talk(args)
\ No newline at end of file
+    return _talk(args)
\ No newline at end of file
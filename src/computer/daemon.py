@@ -0,0 +1,240 @@
+from concurrent.futures import CancelledError, Future
+import io
+import os
+import queue
+import shlex
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from computer.daemon_client import command_name, receive_frame, send_frame, shell_excluded_commands, socket_path
+
+def add_daemon_parsers(subparser):
+    subcommand_parser = subparser.add_parser('daemon', help='daemon command')
+    subcommand_subparser = subcommand_parser.add_subparsers(dest='subcommand', title='daemon subcommand', required=True)
+    start_parser = subcommand_subparser.add_parser('start', help='start daemon')
+    start_parser.add_argument('-d', '--detach', action='store_true', help='run in background')
+    stop_parser = subcommand_subparser.add_parser('stop', help='stop daemon')
+    status_parser = subcommand_subparser.add_parser('status', help='show daemon status')
+    shell_parser = subparser.add_parser('shell', help='interactive shell')
+    return subcommand_subparser
+
+class _SocketWriter(io.TextIOBase):
+
+    def __init__(self, stream, name):
+        self._stream = stream
+        self._name = name
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if len(text) > 0:
+            send_frame(self._stream, {self._name: text})
+        return len(text)
+
+class _SocketReader(io.TextIOBase):
+
+    def __init__(self, input_stream, output_stream):
+        self._input_stream = input_stream
+        self._output_stream = output_stream
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        send_frame(self._output_stream, {'stdin': True})
+        frame = receive_frame(self._input_stream)
+        return frame.get('stdin', '') if frame else ''
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        request = receive_frame(self.rfile)
+        if request is None:
+            return
+        if request.get('shutdown'):
+            self.server.stop()
+            send_frame(self.wfile, {'exit': 0})
+            return
+
+        stream = self.wfile
+        # commands swap process-global streams, environ and cwd, so a busy daemon sends the client back to run locally
+        if not self.server.command_lock.acquire(blocking=False):
+            send_frame(stream, {'busy': True})
+            return
+        try:
+            exit_code = self.server.call_in_main_thread(lambda: self._run_command(request))
+            send_frame(stream, {'exit': exit_code})
+        except CancelledError:
+            send_frame(stream, {'busy': True})
+        except OSError:
+            pass
+        finally:
+            self.server.command_lock.release()
+
+    def _run_command(self, request):
+        stream = self.wfile
+        saved_io = (sys.stdin, sys.stdout, sys.stderr)
+        saved_environ = dict(os.environ)
+        saved_cwd = os.getcwd()
+        try:
+            os.environ.update(request.get('environ', {}))
+            os.chdir(request.get('cwd', saved_cwd))
+            (sys.stdin, sys.stdout, sys.stderr) = (_SocketReader(self.rfile, stream), _SocketWriter(stream, 'stdout'), _SocketWriter(stream, 'stderr'))
+            exit_code = self.server.run_command(request.get('argv', []))
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            (sys.stdin, sys.stdout, sys.stderr) = saved_io
+            os.chdir(saved_cwd)
+            os.environ.clear()
+            os.environ.update(saved_environ)
+        return exit_code
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path, run_command):
+        self.run_command = run_command
+        self.command_lock = threading.Lock()
+        self._calls = queue.Queue()
+        self._stopping = False
+        self._closed = False
+        self._lock = threading.Lock()
+        super().__init__(path, _RequestHandler)
+
+    # run deadlines rely on SIGALRM, which only the main thread receives
+    def call_in_main_thread(self, function):
+        future = Future()
+        with self._lock:
+            if self._stopping:
+                future.cancel()
+            else:
+                self._calls.put((future, function))
+        return future.result()
+
+    def serve(self):
+        threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.2}, daemon=True).start()
+        while True:
+            call = self._calls.get()
+            if call is None:
+                break
+            (future, function) = call
+            try:
+                future.set_result(function())
+            except BaseException as e:
+                future.set_exception(e)
+                if not isinstance(e, Exception):
+                    raise
+        # let the last command send its exit code before the process ends
+        with self.command_lock:
+            pass
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            self._calls.put(None)
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self.shutdown()
+            self.server_close()
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+def _daemon_running():
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+def start_daemon(args):
+    from computer.environment import env
+    from computer.main import build_parser, run_command
+
+    if _daemon_running():
+        print('Daemon is already running', file=sys.stderr)
+        return
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    parser = build_parser()
+    if args.detach:
+        if os.fork() > 0:
+            print(f'Daemon is listening on {socket_path}', file=sys.stderr)
+            return
+        os.setsid()
+        with open(os.devnull, 'r+') as devnull:
+            for fd in [0, 1, 2]:
+                os.dup2(devnull.fileno(), fd)
+
+    saved_umask = os.umask(0o077)
+    try:
+        server = _Server(socket_path, lambda argv: env.reload() or run_command(parser, argv))
+    finally:
+        os.umask(saved_umask)
+    if not args.detach:
+        print(f'Daemon is listening on {socket_path}', file=sys.stderr)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+def stop_daemon(args):
+    if not _daemon_running():
+        print('Daemon is not running', file=sys.stderr)
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        with client.makefile('rwb') as stream:
+            send_frame(stream, {'shutdown': True})
+            receive_frame(stream)
+    print('Daemon is stopped', file=sys.stderr)
+
+def status_daemon(args):
+    if _daemon_running():
+        print(f'Daemon is listening on {socket_path}')
+    else:
+        print('Daemon is not running')
+
+def shell(args):
+    from computer.main import build_parser, run_command
+
+    parser = build_parser()
+    while True:
+        try:
+            line = input('computer> ')
+        except EOFError:
+            print()
+            break
+        except KeyboardInterrupt:
+            print()
+            continue
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            continue
+        if len(argv) == 0:
+            continue
+        if argv[0] in ['exit', 'quit']:
+            break
+        if command_name(argv) in shell_excluded_commands:
+            print(f'{argv[0]} is not available in the shell', file=sys.stderr)
+            continue
+        try:
+            run_command(parser, argv)
+        except KeyboardInterrupt:
+            print('Interrupted', file=sys.stderr)
\ No newline at end of file
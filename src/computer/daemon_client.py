@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import socket
+import sys
+
+socket_path = os.path.expanduser('~') + '/.assistant/daemon.sock'
+local_commands = ['daemon', 'shell', 'cancel']
+shell_excluded_commands = ['daemon', 'shell']
+_forwarded_environ_prefixes = ['OPENAI_', 'COMPUTER_SESSION']
+
+def send_frame(stream, frame):
+    stream.write(json.dumps(frame, ensure_ascii=True).encode('ascii') + b'\n')
+    stream.flush()
+
+def receive_frame(stream):
+    line = stream.readline()
+    return json.loads(line) if line else None
+
+def add_global_arguments(parser):
+    parser.add_argument('--refresh', action='store_true', help='refresh cached assistant and file lists')
+    parser.add_argument('-s', '--session', help='conversation session name (default: $COMPUTER_SESSION)')
+    parser.add_argument('--profile', action='store_true', help='print time spent in each phase')
+    parser.add_argument('--trace-output', metavar='PATH', help='write trace spans as JSON')
+
+def parse_global_arguments(argv):
+    parser = argparse.ArgumentParser(add_help=False, exit_on_error=False)
+    add_global_arguments(parser)
+    parser.add_argument('command', nargs='?')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER)
+    try:
+        (args, _) = parser.parse_known_args(argv)
+    except argparse.ArgumentError:
+        return None
+    return args
+
+def command_name(argv):
+    args = parse_global_arguments(argv)
+    return args.command if args is not None else None
+
+def forward_command(argv):
+    if os.environ.get('COMPUTER_NO_DAEMON') or command_name(argv) in local_commands or not os.path.exists(socket_path):
+        return None
+
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socket_path)
+    except OSError:
+        return None
+
+    with client, client.makefile('rwb') as stream:
+        environ = {k: v for k, v in os.environ.items() if any(k.startswith(p) for p in _forwarded_environ_prefixes)}
+        send_frame(stream, {'argv': argv, 'cwd': os.getcwd(), 'environ': environ})
+        while True:
+            frame = receive_frame(stream)
+            if frame is None:
+                print('Daemon closed the connection', file=sys.stderr)
+                return 1
+            elif 'busy' in frame:
+                return None
+            elif 'stdout' in frame:
+                sys.stdout.write(frame['stdout'])
+                sys.stdout.flush()
+            elif 'stderr' in frame:
+                sys.stderr.write(frame['stderr'])
+                sys.stderr.flush()
+            elif 'stdin' in frame:
+                send_frame(stream, {'stdin': sys.stdin.read()})
+            elif 'exit' in frame:
+                return frame['exit']
\ No newline at end of file
@@ -1,62 +1,321 @@
+from contextlib import contextmanager
+import fcntl
 import json
 import os
 import sys
+import threading
 from enum import Enum
-from loguru import logger as loguru_logger
+
+def strtobool(value):
+    value = value.lower()
+    if value in ['y', 'yes', 't', 'true', 'on', '1']:
+        return 1
+    elif value in ['n', 'no', 'f', 'false', 'off', '0']:
+        return 0
+    else:
+        raise ValueError(f'invalid truth value {value}')
+
+_log_levels = {
+    'TRACE': 5,
+    'DEBUG': 10,
+    'INFO': 20,
+    'SUCCESS': 25,
+    'WARNING': 30,
+    'ERROR': 40,
+    'CRITICAL': 50
+}
+
+class _LoggerOptions:
+
+    def __init__(self, logger, options):
+        self._logger = logger
+        self._options = options
+
+    def debug(self, message, *args, **kwargs):
+        self._logger._log('DEBUG', self._options, message, args, kwargs)
+
+    def info(self, message, *args, **kwargs):
+        self._logger._log('INFO', self._options, message, args, kwargs)
+
+    def warning(self, message, *args, **kwargs):
+        self._logger._log('WARNING', self._options, message, args, kwargs)
+
+    def error(self, message, *args, **kwargs):
+        self._logger._log('ERROR', self._options, message, args, kwargs)
+
+class _Logger:
+
+    _stderr_level = 'INFO'
+
+    def __init__(self):
+        self._logger = None
+        self._min_level = None
+        self._file_level = None
+        self._reading_config = False
+
+    def _config(self, name, default):
+        if self._reading_config:
+            return default
+        self._reading_config = True
+        try:
+            value = config.retrieve(name)
+        finally:
+            self._reading_config = False
+        return value if value else default
+
+    def _enabled(self, level):
+        if self._min_level is None:
+            self._file_level = self._config('log_level', 'INFO').upper()
+            self._min_level = min(_log_levels.get(self._file_level, 20), _log_levels[self._stderr_level])
+        return _log_levels[level] >= self._min_level
+
+    def _load(self):
+        if self._logger is None:
+            from loguru import logger as loguru_logger
+            loguru_logger.remove()
+            loguru_logger.add(sys.stderr, level=self._stderr_level)
+            log_dir = self._config('log_dir', f'{env.data_dir()}/log')
+            retention = self._config('log_retention', '5')
+            loguru_logger.add(
+                f'{log_dir}/log.txt',
+                level=self._file_level,
+                rotation=self._config('log_rotation', '10 MB'),
+                retention=int(retention) if retention.isdigit() else retention,
+                compression='gz',
+                enqueue=True
+            )
+            self._logger = loguru_logger
+        return self._logger
+
+    def _log(self, level, options, message, args, kwargs):
+        if self._enabled(level):
+            self._load().opt(depth=2, **options).log(level, message, *args, **kwargs)
+
+    def opt(self, **options):
+        return _LoggerOptions(self, options)
+
+    def debug(self, message, *args, **kwargs):
+        self._log('DEBUG', {}, message, args, kwargs)
+
+    def info(self, message, *args, **kwargs):
+        self._log('INFO', {}, message, args, kwargs)
+
+    def warning(self, message, *args, **kwargs):
+        self._log('WARNING', {}, message, args, kwargs)
+
+    def error(self, message, *args, **kwargs):
+        self._log('ERROR', {}, message, args, kwargs)
 
 class Env:
 
+    _journal_compaction_size = 256 * 1024
+    _session_names = ['thread', 'assistant', 'summary']
+
     def __new__(cls, *args, **kargs):
         if not hasattr(cls, '_instance'):
             cls._instance = super(Env, cls).__new__(cls)
 
-            cls._logger = loguru_logger
-            cls._logger.remove()
-            cls._logger.add(sys.stderr, level='INFO')
-            cls._logger.add( 'log/log.txt', level='DEBUG')
+            cls._logger = _Logger()
 
             cls._data_dir = os.path.expanduser('~') + '/.assistant'
             os.makedirs(cls._data_dir, exist_ok=True)
-            cls._memory_path = f'{cls._data_dir}/memory.json'
+            cls._legacy_memory_path = f'{cls._data_dir}/memory.json'
+            cls._memory_path = f'{cls._data_dir}/state.json'
+            cls._journal_path = f'{cls._data_dir}/state.log'
+            cls._lock_path = f'{cls._data_dir}/state.lock'
+            cls._lock_file = None
+            cls._thread_lock = threading.RLock()
             cls._memory = {}
-            cls._load_memory()
+            cls._persisted = {}
+            cls._generation = 0
+            cls._snapshot_stat = None
+            cls._journal_offset = 0
+            cls._memory_loaded = False
+            cls._session = None
 
         return cls._instance
 
     @classmethod
-    def _load_memory(cls):
+    @contextmanager
+    def _locked(cls, operation=fcntl.LOCK_EX):
+        with cls._thread_lock:
+            if cls._lock_file is not None:
+                yield
+                return
+            with open(cls._lock_path, 'a') as f:
+                fcntl.flock(f.fileno(), operation)
+                cls._lock_file = f
+                try:
+                    yield
+                finally:
+                    cls._lock_file = None
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @classmethod
+    def _stat_snapshot(cls):
         try:
-            with open(f'{cls._memory_path}', 'r') as f:
-                cls._memory = json.load(f)
-            cls._logger.debug(f'Load memory: {cls._memory}')
-        except Exception as e:
-            cls._logger.debug(f'Failed to load memory from {cls._memory_path}')
+            stat = os.stat(cls._memory_path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def _read_snapshot(cls):
+        try:
+            with open(cls._memory_path, 'r') as f:
+                snapshot = json.load(f)
+            return (snapshot['generation'], snapshot['memory'])
+        except FileNotFoundError:
+            pass
+        except Exception:
+            cls._logger.debug('Failed to load memory from {}', cls._memory_path)
+            return (0, {})
+
+        try:
+            with open(cls._legacy_memory_path, 'r') as f:
+                return (0, json.load(f))
+        except Exception:
+            cls._logger.debug('Failed to load memory from {}', cls._legacy_memory_path)
+            return (0, {})
+
+    @classmethod
+    def _apply_entry(cls, entry):
+        if entry['op'] == 'set':
+            cls._memory[entry['name']] = entry['value']
+        elif entry['op'] == 'remove':
+            cls._memory.pop(entry['name'], None)
+        elif entry['op'] == 'set_field':
+            cls._memory.setdefault(entry['name'], {})[entry['field']] = entry['value']
 
+    @classmethod
+    def _replay_journal(cls):
+        try:
+            with open(cls._journal_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < cls._journal_offset:
+                    cls._journal_offset = 0
+                f.seek(cls._journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            cls._journal_offset = 0
+            return set()
+        complete_size = data.rfind(b'\n') + 1
+        cls._journal_offset += complete_size
+        names = set()
+        for line in data[:complete_size].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('generation') != cls._generation:
+                continue
+            cls._apply_entry(entry)
+            names.add(entry['name'])
+        return names
+
+    @classmethod
+    def _load_memory(cls):
+        with cls._locked(fcntl.LOCK_SH):
+            cls._snapshot_stat = cls._stat_snapshot()
+            (cls._generation, cls._memory) = cls._read_snapshot()
+            cls._journal_offset = 0
+            cls._replay_journal()
+        cls._persisted = {name: json.dumps(value, ensure_ascii=True) for name, value in cls._memory.items()}
         cls._memory_loaded = True
 
     @classmethod
-    def _save_memory(cls):
+    def _merge_memory(cls):
+        if cls._stat_snapshot() != cls._snapshot_stat:
+            cls._snapshot_stat = cls._stat_snapshot()
+            (cls._generation, cls._memory) = cls._read_snapshot()
+            cls._journal_offset = 0
+            names = set(cls._memory) | set(cls._persisted)
+            names |= cls._replay_journal()
+        else:
+            names = cls._replay_journal()
+        for name in names:
+            if name in cls._memory:
+                cls._persisted[name] = json.dumps(cls._memory[name], ensure_ascii=True)
+            else:
+                cls._persisted.pop(name, None)
+
+    @classmethod
+    def _unchanged(cls, entry):
+        name = entry['name']
+        if entry['op'] == 'set':
+            return cls._persisted.get(name) == json.dumps(entry['value'], ensure_ascii=True)
+        elif entry['op'] == 'remove':
+            return name not in cls._persisted
+        elif entry['op'] == 'set_field':
+            return name in cls._persisted and cls._memory.get(name, {}).get(entry['field']) == entry['value']
+        return False
+
+    @classmethod
+    def _write_journal(cls, entry):
+        applied = False
         try:
-            with open(f'{cls._memory_path}', 'w') as f:
-                json.dump(cls._memory, f, ensure_ascii=True)
-            cls._logger.debug(f'Save memory: {cls._memory}')
-        except Exception as e:
-            cls._logger.debug(f'Failed to save memory to {cls._memory_path}')
+            with cls._locked():
+                cls._merge_memory()
+                unchanged = cls._unchanged(entry)
+                entry['generation'] = cls._generation
+                cls._apply_entry(entry)
+                applied = True
+                if entry['name'] in cls._memory:
+                    cls._persisted[entry['name']] = json.dumps(cls._memory[entry['name']], ensure_ascii=True)
+                else:
+                    cls._persisted.pop(entry['name'], None)
+                if unchanged:
+                    return
+                separator = '\n' if os.path.exists(cls._journal_path) and os.path.getsize(cls._journal_path) > cls._journal_offset else ''
+                with open(cls._journal_path, 'ab') as f:
+                    f.write((separator + json.dumps(entry, ensure_ascii=True) + '\n').encode('utf-8'))
+                cls._journal_offset = os.path.getsize(cls._journal_path)
+                if cls._journal_offset > cls._journal_compaction_size:
+                    cls._compact()
+        except Exception:
+            cls._logger.debug('Failed to save memory to {}', cls._journal_path)
+            if not applied:
+                cls._apply_entry(entry)
+
+    @classmethod
+    def _compact(cls):
+        temporary_path = f'{cls._memory_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump({'generation': cls._generation + 1, 'memory': cls._memory}, f, ensure_ascii=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, cls._memory_path)
+        cls._generation += 1
+        open(cls._journal_path, 'w').close()
+        cls._snapshot_stat = cls._stat_snapshot()
+        cls._journal_offset = 0
 
     def __init__(self):
         pass
 
+    def _ensure_memory(self):
+        if not self._memory_loaded:
+            self._load_memory()
+
+    def _session_key(self, name):
+        if self._session and name in self._session_names:
+            return f'{name}@{self._session}'
+        return name
+
     def _get_memory(self, name):
-        return self._memory.get(name)
+        self._ensure_memory()
+        return self._memory.get(self._session_key(name))
 
     def _set_memory(self, name, value):
-        self._memory[name] = value
+        self._ensure_memory()
+        self._write_journal({'op': 'set', 'name': self._session_key(name), 'value': value})
+
+    def _set_memory_field(self, name, field, value):
+        self._ensure_memory()
+        self._write_journal({'op': 'set_field', 'name': self._session_key(name), 'field': field, 'value': value})
 
     def _remove_memory(self, name):
-        try:
-            del self._memory[name]
-        except KeyError:
-            pass
+        self._ensure_memory()
+        self._write_journal({'op': 'remove', 'name': self._session_key(name)})
 
     def get(self, name):
         return os.environ.get(name)
@@ -70,67 +329,132 @@ class Env:
     def data_dir(self):
         return self._data_dir
 
+    def reload(self):
+        self._load_memory()
+
+    def use_session(self, session):
+        Env._session = session if session else None
+
+    def session(self):
+        return self._session
+
+    def sessions(self):
+        self._ensure_memory()
+        return sorted({name.split('@', 1)[1] for name in self._memory if '@' in name and name.split('@', 1)[0] in self._session_names})
+
+    def retrieve_from_session(self, session, name):
+        self._ensure_memory()
+        return self._memory.get(f'{name}@{session}')
+
+    def remove_session(self, session):
+        self._ensure_memory()
+        for name in self._session_names:
+            key = f'{name}@{session}'
+            if key in self._memory or key in self._persisted:
+                self._write_journal({'op': 'remove', 'name': key})
+
     def retrieve(self, name):
         return self._get_memory(name)
 
     def store(self, name, value):
         self._set_memory(name, value)
-        self._save_memory()
+
+    def store_field(self, name, field, value):
+        self._set_memory_field(name, field, value)
 
     def remove(self, name):
         self._remove_memory(name)
-        self._save_memory()
 
 class Config:
 
     _global_config_names = [
         'auto_select_model_name',
-        'assistant_always_reassigned'
+        'assistant_always_reassigned',
+        'run_streaming',
+        'run_poll_interval_max',
+        'run_timeout',
+        'run_cancel_wait',
+        'chat_completion_streaming',
+        'metadata_cache_ttl',
+        'list_page_size',
+        'upload_retries',
+        'tool_timeout',
+        'upload_part_threshold_mb',
+        'upload_part_size_mb',
+        'upload_part_jobs',
+        'context_token_budget',
+        'context_summary_model',
+        'router_min_score',
+        'router_min_margin',
+        'response_cache',
+        'response_cache_ttl',
+        'response_cache_max_entries',
+        'assistant_retries',
+        'log_level',
+        'log_dir',
+        'log_rotation',
+        'log_retention',
+        'http_max_connections',
+        'http_max_keepalive_connections',
+        'http_keepalive_expiry',
+        'http2',
+        'request_timeout',
+        'connect_timeout',
+        'max_retries'
     ]
 
     def __new__(cls, *args, **kargs):
         if not hasattr(cls, '_instance'):
             cls._instance = super(Config, cls).__new__(cls)
 
-            config = env.retrieve('config')
-            if not config:
-                config = {}
-
-            for n in cls._global_config_names:
-                if not n in config:
-                    config[n] = None
-
-            env.store('config', config)
-
         return cls._instance
 
+    def _retrieve_config(self):
+        config = dict.fromkeys(self._global_config_names)
+        config.update(env.retrieve('config') or {})
+        return config
+
     def retrieve(self, name):
         if name not in self._global_config_names:
             raise KeyError
 
-        config = env.retrieve('config')
+        config = self._retrieve_config()
         value = config.get(name)
         return value
 
+    def retrieve_bool(self, name, default=False):
+        value = self.retrieve(name)
+        if value is None or value == '':
+            return default
+        try:
+            return bool(strtobool(value))
+        except ValueError:
+            return default
+
+    def retrieve_float(self, name, default=None):
+        value = self.retrieve(name)
+        if value is None or value == '':
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            return default
+
     def retrieve_all(self):
-        config = env.retrieve('config')
+        config = self._retrieve_config()
         return config
 
     def store(self, name, value):
         if name not in self._global_config_names:
             raise KeyError
 
-        config = env.retrieve('config')
-        config[name] = value
-        env.store('config', config)
+        env.store_field('config', name, value)
 
     def remove(self, name):
         if name not in self._global_config_names:
             raise KeyError
 
-        config = env.retrieve('config')
-        config[name] = None
-        env.store('config', config)
+        env.store_field('config', name, None)
 
 env = Env()
 logger = Env().logger()
@@ -1,8 +1,21 @@
-from time import sleep
-import openai
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import hashlib
+import io
+import mimetypes
+import os
+import sys
+import threading
+from time import time
 
-from computer.environment import logger
-from computer.util import get_all_files
+from computer.cache import Cache
+from computer.client import call_with_retries, get_client
+from computer.environment import config, logger
+from computer.lazy import lazy_import
+from computer.trace import traced
+from computer.util import get_all_files, update_file_cache
+
+openai = lazy_import('openai')
 
 def add_file_parsers(subparser):
     subcommand_parser = subparser.add_parser('file', help='file command')
@@ -12,6 +25,7 @@ def add_file_parsers(subparser):
     list_parser.add_argument('-S', '--separator', default=' ', help='output field separator')
     create_parser = subcommand_subparser.add_parser('create', help='create file')
     create_parser.add_argument('file', nargs='*', help='file path')
+    create_parser.add_argument('-j', '--jobs', type=int, default=4, help='number of concurrent uploads')
 
 def list_files(args):
     separator = args.separator
@@ -19,8 +33,8 @@ def list_files(args):
     purpose = 'assistants'
 
     files = get_all_files(purpose=purpose)
-    logger.debug('List files: ' + ','.join([f.id for f in files]))
-    for file_data in files.data:
+    logger.opt(lazy=True).debug('List files: {}', lambda: ','.join([f.id for f in files]))
+    for file_data in files:
         id = file_data.id if file_data.id else 'None'
         filename = file_data.filename if file_data.filename else 'None'
         purpose = file_data.purpose if file_data.purpose else 'None'
@@ -30,14 +44,231 @@ def list_files(args):
         else:
             print(separator.join([id, filename]))
 
+class _Progress:
+
+    def __init__(self, total, stream=None):
+        self._stream = stream if stream is not None else sys.stderr
+        self._enabled = self._stream.isatty()
+        self._total = total
+        self._done = 0
+        self._started_at = time()
+        self._printed_at = 0.0
+        self._pending = False
+        self._lock = threading.Lock()
+
+    def update(self, size):
+        with self._lock:
+            self._done += size
+            self._print()
+
+    def skip(self, size):
+        with self._lock:
+            self._total -= size
+            self._print()
+
+    def _print(self, force=False):
+        now = time()
+        if not self._enabled or (not force and now - self._printed_at < 0.2):
+            return
+        self._printed_at = now
+        self._pending = True
+        percentage = self._done * 100 / self._total if self._total > 0 else 100
+        rate = self._done / max(now - self._started_at, 1e-6) / 1e6
+        print(f'\rUploading {self._done / 1e6:.1f}/{self._total / 1e6:.1f} MB ({percentage:.0f}%) {rate:.2f} MB/s', end='', file=self._stream, flush=True)
+
+    def interrupt(self):
+        with self._lock:
+            if self._pending:
+                print(file=self._stream)
+                self._pending = False
+
+    def finish(self):
+        with self._lock:
+            if self._printed_at > 0:
+                self._print(force=True)
+        self.interrupt()
+
+class _HashingReader(io.RawIOBase):
+
+    def __init__(self, fd, progress):
+        self._fd = fd
+        self._progress = progress
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        chunk = self._fd.read(size)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        self._progress.update(len(chunk))
+        return chunk
+
+    def fileno(self):
+        return self._fd.fileno()
+
+@traced('hash file')
+def _hash_file(filepath, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _with_retries(description, function):
+    return call_with_retries(f'upload of {description}', function, int(config.retrieve_float('upload_retries', 3)))
+
+def _upload_whole_file(filepath, purpose, progress):
+    def attempt():
+        with open(filepath, 'rb') as fd:
+            reader = _HashingReader(fd, progress)
+            try:
+                file = get_client().with_options(max_retries=0).files.create(file=(os.path.basename(filepath), reader), purpose=purpose)
+            except BaseException:
+                progress.update(-reader.size)
+                raise
+        return (file, reader.digest.hexdigest())
+    return _with_retries(filepath, attempt)
+
+def _upload_part(upload_id, index, chunk, progress):
+    def attempt():
+        return get_client().with_options(max_retries=0).post(f'/uploads/{upload_id}/parts', body={}, files=[('data', (f'part{index}', chunk))], options={'headers': {'Content-Type': 'multipart/form-data'}}, cast_to=object)
+    part = _with_retries(f'part {index} of {upload_id}', attempt)
+    progress.update(len(chunk))
+    return part
+
+def _upload_file_in_parts(filepath, purpose, progress):
+    part_size = int(config.retrieve_float('upload_part_size_mb', 8) * 1024 * 1024)
+    jobs = max(int(config.retrieve_float('upload_part_jobs', 4)), 1)
+    mime_type = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+    body = {'filename': os.path.basename(filepath), 'purpose': purpose, 'bytes': os.path.getsize(filepath), 'mime_type': mime_type}
+    upload = get_client().post('/uploads', body=body, cast_to=object)
+    logger.debug('Create upload: {}', upload)
+
+    digest = hashlib.sha256()
+    try:
+        with open(filepath, 'rb') as fd, ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = []
+            pending = set()
+            for index, chunk in enumerate(iter(lambda: fd.read(part_size), b'')):
+                digest.update(chunk)
+                if len(pending) >= jobs:
+                    (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                future = executor.submit(_upload_part, upload['id'], index, chunk, progress)
+                futures.append(future)
+                pending.add(future)
+            part_ids = [future.result()['id'] for future in futures]
+        completed = get_client().post(f'/uploads/{upload["id"]}/complete', body={'part_ids': part_ids}, cast_to=object)
+    except BaseException:
+        try:
+            get_client().post(f'/uploads/{upload["id"]}/cancel', body={}, cast_to=object)
+        except Exception:
+            logger.debug('Failed to cancel upload {}', upload['id'])
+        raise
+    logger.debug('Complete upload: {}', completed)
+    return (openai.types.FileObject.construct(**completed['file']), digest.hexdigest())
+
+@traced('upload file')
+def _upload_file(filepath, purpose, progress):
+    threshold = config.retrieve_float('upload_part_threshold_mb', 64) * 1024 * 1024
+    if os.path.getsize(filepath) >= threshold:
+        (file, digest) = _upload_file_in_parts(filepath, purpose, progress)
+    else:
+        (file, digest) = _upload_whole_file(filepath, purpose, progress)
+    logger.debug('Create file: {}', file)
+    return (file, digest)
+
+def _fingerprint(filepath):
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns]
+
 def create_file(args):
     filepaths = args.file
+    jobs = max(args.jobs, 1)
     purpose = 'assistants'
     separator = ' '
 
-    for filepath in filepaths:
-        with open(filepath, 'rb') as fd:
-            file = openai.files.create(file=fd, purpose=purpose)
-            logger.debug(f'Create file: {file}')
+    manifest = Cache('uploads')
+    fingerprints = Cache('fingerprints')
+    uploaded_ids = {file_data.id for file_data in get_all_files(purpose=purpose)}
+    uploaded_sizes = {entry.get('size', entry['bytes']) for (_, entry) in manifest.items() if entry['id'] in uploaded_ids}
+    sizes = {filepath: os.path.getsize(filepath) for filepath in filepaths if os.path.isfile(filepath)}
+    size_counts = Counter(sizes.values())
+    claimed_digests = set()
+    lock = threading.Lock()
+    progress = _Progress(sum(sizes.values()))
+
+    def known_digest(filepath):
+        entry = fingerprints.get(os.path.realpath(filepath))
+        if entry is not None and entry['fingerprint'] == _fingerprint(filepath):
+            return entry['digest']
+        return None
+
+    def upload(filepath):
+        size = os.path.getsize(filepath)
+        digest = known_digest(filepath)
+        if digest is None and (size_counts[size] > 1 or size in uploaded_sizes):
+            digest = _hash_file(filepath)
+        if digest is not None:
+            with lock:
+                if digest in claimed_digests:
+                    progress.skip(size)
+                    return ('duplicate', digest, None)
+                claimed_digests.add(digest)
+            uploaded = manifest.get(digest)
+            if uploaded is not None and uploaded['id'] in uploaded_ids:
+                progress.skip(size)
+                return ('skipped', digest, uploaded)
+        (file, digest) = _upload_file(filepath, purpose, progress)
+        return ('uploaded', digest, file)
+
+    started_at = time()
+    (uploaded_count, uploaded_bytes, skipped_count, failed_count) = (0, 0, 0, 0)
+    (finished, duplicates) = ({}, {})
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(upload, filepath): filepath for filepath in filepaths}
+        for future in as_completed(futures):
+            filepath = futures[future]
+            progress.interrupt()
+            try:
+                (result, digest, file) = future.result()
+            except Exception as e:
+                print(f'Failed to upload {filepath}: {e}', file=sys.stderr)
+                failed_count += 1
+                continue
+
+            fingerprints.set(os.path.realpath(filepath), {'fingerprint': _fingerprint(filepath), 'digest': digest})
+            if result == 'uploaded':
+                size = os.path.getsize(filepath)
+                manifest.set(digest, {'id': file.id, 'filename': file.filename, 'bytes': file.bytes, 'size': size})
+                manifest.save()
+                update_file_cache(added=file)
+                uploaded_count += 1
+                uploaded_bytes += size
+                finished[digest] = [file.id, file.filename]
+                print(separator.join(finished[digest]))
+            elif result == 'skipped':
+                skipped_count += 1
+                finished[digest] = [file['id'], file['filename']]
+                print(separator.join(finished[digest]))
+                print(f'Skip {filepath}: already uploaded as {file["id"]}', file=sys.stderr)
+            else:
+                duplicates.setdefault(digest, []).append(filepath)
+            if digest in finished:
+                for duplicate_path in duplicates.pop(digest, []):
+                    skipped_count += 1
+                    print(separator.join(finished[digest]))
+                    print(f'Skip {duplicate_path}: same content as another file in this upload', file=sys.stderr)
+    for duplicate_path in [path for paths in duplicates.values() for path in paths]:
+        print(f'Failed to upload {duplicate_path}: another file with the same content failed', file=sys.stderr)
+        failed_count += 1
+    fingerprints.save()
+    progress.finish()
 
-        print(separator.join([file.id, file.filename]))
\ No newline at end of file
+    elapsed = max(time() - started_at, 1e-6)
+    if len(filepaths) > 1:
+        print(f'Uploaded {uploaded_count} files ({skipped_count} skipped, {failed_count} failed) in {elapsed:.1f}s: {uploaded_count / elapsed:.2f} files/s, {uploaded_bytes / elapsed / 1e6:.2f} MB/s', file=sys.stderr)
\ No newline at end of file
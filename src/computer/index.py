@@ -0,0 +1,48 @@
+class NameIndex:
+
+    _gram_size = 3
+
+    def __init__(self, objects, name_function):
+        self._objects = {}
+        self._positions = {}
+        self._names = {}
+        self._id_names = {}
+        self._grams = {}
+        for position, o in enumerate(objects):
+            name = name_function(o) or ''
+            self._objects[o.id] = o
+            self._positions[o.id] = position
+            self._id_names[o.id] = name
+            self._names.setdefault(name, []).append(o.id)
+            for gram in self._split_grams(name):
+                self._grams.setdefault(gram, set()).add(o.id)
+
+    def _split_grams(self, text):
+        return {text[i:i + self._gram_size] for i in range(len(text) - self._gram_size + 1)}
+
+    def _ordered(self, ids):
+        return sorted(set(ids), key=lambda id: self._positions[id])
+
+    def __len__(self):
+        return len(self._objects)
+
+    def objects(self, ids):
+        return [self._objects[id] for id in ids]
+
+    def get(self, id):
+        return self._objects.get(id)
+
+    def exact(self, name):
+        return list(self._names.get(name, []))
+
+    def substring(self, text):
+        if len(text) < self._gram_size:
+            candidates = [id for name in self._names if text in name for id in self._names[name]]
+        else:
+            grams = sorted(self._split_grams(text), key=lambda gram: len(self._grams.get(gram, ())))
+            candidates = set(self._grams.get(grams[0], ()))
+            for gram in grams[1:]:
+                if len(candidates) == 0:
+                    break
+                candidates &= self._grams.get(gram, set())
+        return self._ordered([id for id in candidates if text in self._id_names[id]])
\ No newline at end of file
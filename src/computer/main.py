@@ -1,33 +1,61 @@
 import argparse
+import importlib
 import io
+import os
 import sys
 
-from computer.assistant import add_assistant_parsers, create_assistant, delete_assistant, list_assistants
-from computer.config import add_config_parsers, list_config, print_config, set_config, remove_config
-from computer.conversation import add_conversation_parsers, retrieve, select, talk, talk_next, unselect
-from computer.file import add_file_parsers, create_file, list_files
+from computer import trace
+from computer.daemon_client import add_global_arguments, command_name, forward_command, parse_global_arguments
+
+parser_modules = {
+    'computer.conversation': ('add_conversation_parsers', ['cancel', 'next', 'retrieve', 'select', 'session', 'talk', 'unselect']),
+    'computer.assistant': ('add_assistant_parsers', ['assistant']),
+    'computer.file': ('add_file_parsers', ['file']),
+    'computer.batch': ('add_batch_parsers', ['batch']),
+    'computer.response_cache': ('add_response_cache_parsers', ['cache']),
+    'computer.config': ('add_config_parsers', ['config']),
+    'computer.daemon': ('add_daemon_parsers', ['daemon', 'shell'])
+}
 
 command_functions = {
     'assistant': {
-        'create': create_assistant,
-        'delete': delete_assistant,
-        'list': list_assistants
+        'apply': 'computer.assistant:apply_assistants',
+        'create': 'computer.assistant:create_assistant',
+        'delete': 'computer.assistant:delete_assistant',
+        'list': 'computer.assistant:list_assistants',
+        'sync': 'computer.assistant:sync_assistants'
+    },
+    'batch': 'computer.batch:batch',
+    'cancel': 'computer.conversation:cancel',
+    'cache': {
+        'clear': 'computer.response_cache:clear_response_cache',
+        'stats': 'computer.response_cache:stats_response_cache'
     },
     'config': {
-        'list': list_config,
-        'print': print_config,
-        'set': set_config,
-        'remove': remove_config
+        'list': 'computer.config:list_config',
+        'print': 'computer.config:print_config',
+        'set': 'computer.config:set_config',
+        'remove': 'computer.config:remove_config'
+    },
+    'daemon': {
+        'start': 'computer.daemon:start_daemon',
+        'status': 'computer.daemon:status_daemon',
+        'stop': 'computer.daemon:stop_daemon'
     },
     'file': {
-        'create': create_file,
-        'list': list_files
+        'create': 'computer.file:create_file',
+        'list': 'computer.file:list_files'
+    },
+    'next': 'computer.conversation:talk_next',
+    'retrieve': 'computer.conversation:retrieve',
+    'select': 'computer.conversation:select',
+    'session': {
+        'list': 'computer.conversation:list_sessions',
+        'remove': 'computer.conversation:remove_session'
     },
-    'next': talk_next,
-    'retrieve': retrieve,
-    'select': select,
-    'talk': talk,
-    'unselect': unselect
+    'shell': 'computer.daemon:shell',
+    'talk': 'computer.conversation:talk',
+    'unselect': 'computer.conversation:unselect'
 }
 
 def set_io_buffers():
@@ -35,22 +63,75 @@ def set_io_buffers():
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=True)
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', line_buffering=True)
 
-def main():
-    set_io_buffers()
+def build_parser(argv=None):
+    name = command_name(argv) if argv is not None else None
+    matched_modules = [m for m, (_, commands) in parser_modules.items() if name in commands]
+    modules = matched_modules if len(matched_modules) > 0 else parser_modules.keys()
 
     parser = argparse.ArgumentParser(description='conversation')
+    add_global_arguments(parser)
     subparser = parser.add_subparsers(dest='command', title='conversation', required=True)
-    add_conversation_parsers(subparser)
-    add_assistant_parsers(subparser)
-    add_file_parsers(subparser)
-    add_config_parsers(subparser)
+    for module_name in modules:
+        (function_name, _) = parser_modules[module_name]
+        add_parsers = getattr(importlib.import_module(module_name), function_name)
+        add_parsers(subparser)
+    return parser
+
+def _load_command_function(command_path):
+    (module_name, function_name) = command_path.split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+def run_command(parser, argv):
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return e.code
 
-    args = parser.parse_args()
+    from computer.environment import env
+    env.use_session(args.session or os.environ.get('COMPUTER_SESSION'))
+
+    if args.refresh:
+        _load_command_function('computer.util:invalidate_metadata_cache')()
 
     if 'subcommand' in args:
-        command_function = command_functions[args.command][args.subcommand]
+        command = f'{args.command} {args.subcommand}'
+        command_function = _load_command_function(command_functions[args.command][args.subcommand])
     else:
-        command_function = command_functions[args.command]
-    command_function(args)
+        command = args.command
+        command_function = _load_command_function(command_functions[args.command])
+
+    if not args.profile and not args.trace_output:
+        return command_function(args) or 0
+
+    trace.enable()
+    try:
+        with trace.span(command):
+            exit_code = command_function(args)
+    finally:
+        trace.disable()
+        if args.profile:
+            trace.print_report()
+        if args.trace_output:
+            trace.export(args.trace_output, argv)
+
+    return exit_code or 0
+
+def main():
+    set_io_buffers()
+
+    argv = sys.argv[1:]
+    try:
+        exit_code = forward_command(argv)
+    except KeyboardInterrupt:
+        global_args = parse_global_arguments(argv)
+        if global_args is None or global_args.command not in ['talk', 'next']:
+            raise
+        cancel_argv = (['-s', global_args.session] if global_args.session else []) + ['cancel']
+        print(file=sys.stderr)
+        run_command(build_parser(cancel_argv), cancel_argv)
+        return 130
+    if exit_code is not None:
+        return exit_code
 
-    return 0
\ No newline at end of file
+    parser = build_parser(argv)
+    return run_command(parser, argv)
\ No newline at end of file
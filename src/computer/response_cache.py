@@ -0,0 +1,88 @@
+import hashlib
+import json
+import re
+import sys
+from time import time
+from computer.cache import Cache
+from computer.environment import config, logger
+
+_response_cache = Cache('responses')
+
+def add_response_cache_parsers(subparser):
+    subcommand_parser = subparser.add_parser('cache', help='response cache command')
+    subcommand_subparser = subcommand_parser.add_subparsers(dest='subcommand', title='cache subcommand', required=True)
+    stats_parser = subcommand_subparser.add_parser('stats', help='show response cache statistics')
+    clear_parser = subcommand_subparser.add_parser('clear', help='remove cached responses')
+    return subcommand_subparser
+
+def response_cache_enabled():
+    return config.retrieve_bool('response_cache', False)
+
+def _normalize_message(message):
+    return re.sub(r'\s+', ' ', message.strip())
+
+def _entries():
+    entries = _response_cache.get('entries')
+    if entries is None:
+        entries = {}
+        _response_cache.set('entries', entries)
+    return entries
+
+def _count(name):
+    stats = _response_cache.get('stats') or {'hits': 0, 'misses': 0}
+    stats[name] += 1
+    _response_cache.set('stats', stats)
+
+def build_response_key(target, message, history):
+    history_hash = hashlib.sha256(json.dumps(history, ensure_ascii=True).encode('utf-8')).hexdigest()
+    key = [target, _normalize_message(message), history_hash]
+    return hashlib.sha256(json.dumps(key, ensure_ascii=True).encode('utf-8')).hexdigest()
+
+def lookup_response(key):
+    if not response_cache_enabled():
+        return None
+    entries = _entries()
+    entry = entries.get(key)
+    ttl = config.retrieve_float('response_cache_ttl', 86400.0)
+    expired = entry is not None and time() - entry['stored_at'] >= ttl
+    if expired:
+        del entries[key]
+        entry = None
+    if entry is None:
+        # a miss alone is saved with the response stored after it
+        _count('misses')
+        if expired:
+            _response_cache.save()
+        logger.debug('Response cache miss: {}', key)
+        return None
+    entry['used_at'] = time()
+    _count('hits')
+    _response_cache.save()
+    logger.debug('Response cache hit: {}', key)
+    print('Answer from response cache', file=sys.stderr)
+    return entry['response']
+
+def store_response(key, response):
+    if not response_cache_enabled():
+        return
+    entries = _entries()
+    now = time()
+    entries[key] = {'response': response, 'stored_at': now, 'used_at': now}
+    max_entries = int(config.retrieve_float('response_cache_max_entries', 1000))
+    if len(entries) > max_entries:
+        for old_key in sorted(entries, key=lambda k: entries[k]['used_at'])[:len(entries) - max_entries]:
+            del entries[old_key]
+    _response_cache.save()
+
+def stats_response_cache(args):
+    stats = _response_cache.get('stats') or {'hits': 0, 'misses': 0}
+    lookups = stats['hits'] + stats['misses']
+    hit_rate = stats['hits'] * 100 / lookups if lookups > 0 else 0.0
+    print(f'enabled={response_cache_enabled()}')
+    print(f'entries={len(_entries())}')
+    print(f'hits={stats["hits"]}')
+    print(f'misses={stats["misses"]}')
+    print(f'hit_rate={hit_rate:.1f}%')
+
+def clear_response_cache(args):
+    _response_cache.clear()
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import math
+import re
+from computer.cache import Cache
+from computer.environment import config, logger
+
+_name_weight = 3
+_max_routes = 1000
+_router_cache = Cache('router')
+_route_cache = Cache('routes')
+
+def _tokenize(text):
+    text = text.lower() if text else ''
+    tokens = re.findall(r'[a-z0-9_]{2,}', text)
+    for run in re.findall(r'[^\x00-\x7f\s]+', text):
+        tokens.extend([run[i:i + 2] for i in range(max(len(run) - 1, 1))])
+    return tokens
+
+def _normalize_message(message):
+    return re.sub(r'\s+', ' ', message.strip().lower())
+
+def _signature(assistants):
+    documents = [(a.id, a.name, a.instructions) for a in assistants]
+    return hashlib.sha256(json.dumps(documents, ensure_ascii=True).encode('utf-8')).hexdigest()
+
+def _vectorize(term_counts, idf):
+    vector = {term: (1 + math.log(count)) * idf.get(term, 0.0) for term, count in term_counts.items()}
+    norm = math.sqrt(sum([weight * weight for weight in vector.values()]))
+    return {term: weight / norm for term, weight in vector.items()} if norm > 0 else {}
+
+def _count_terms(tokens):
+    counts = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+def _build_index(assistants):
+    documents = {}
+    for a in assistants:
+        if a.name:
+            documents[a.id] = _count_terms(_tokenize(a.name) * _name_weight + _tokenize(a.instructions))
+    document_frequencies = {}
+    for counts in documents.values():
+        for term in counts:
+            document_frequencies[term] = document_frequencies.get(term, 0) + 1
+    idf = {term: math.log((1 + len(documents)) / (1 + frequency)) + 1 for term, frequency in document_frequencies.items()}
+    vectors = {id: _vectorize(counts, idf) for id, counts in documents.items()}
+    return { 'idf': idf, 'vectors': vectors }
+
+def _load_index(assistants, signature):
+    index = _router_cache.get('index')
+    if index is None or index.get('signature') != signature:
+        index = _build_index(assistants)
+        index['signature'] = signature
+        _router_cache.set('index', index)
+        _router_cache.save()
+    return index
+
+def _load_routes(signature):
+    if _route_cache.get('signature') != signature:
+        _route_cache.set('signature', signature)
+        _route_cache.set('routes', {})
+    return _route_cache.get('routes')
+
+def score_assistants(message, assistants, signature=None):
+    index = _load_index(assistants, signature if signature is not None else _signature(assistants))
+    query = _vectorize(_count_terms(_tokenize(message)), index['idf'])
+    scores = []
+    for id, vector in index['vectors'].items():
+        score = sum([weight * vector.get(term, 0.0) for term, weight in query.items()])
+        scores.append((score, id))
+    return sorted(scores, reverse=True)
+
+def route_message(message, assistants, fallback):
+    signature = _signature(assistants)
+    routes = _load_routes(signature)
+    key = hashlib.sha256(_normalize_message(message).encode('utf-8')).hexdigest()
+    if key in routes:
+        logger.debug('Route from cache: {}', routes[key])
+        return routes[key]
+
+    scores = score_assistants(message, assistants, signature)
+    best = scores[0] if len(scores) > 0 else (0.0, None)
+    second = scores[1] if len(scores) > 1 else (0.0, None)
+    min_score = config.retrieve_float('router_min_score', 0.1)
+    min_margin = config.retrieve_float('router_min_margin', 0.05)
+    logger.opt(lazy=True).debug('Route scores: {}', lambda: scores[:3])
+    if best[0] >= min_score and best[0] - second[0] >= min_margin:
+        assistant_id = best[1]
+    else:
+        assistant_id = fallback()
+
+    routes[key] = assistant_id
+    for old_key in list(routes)[:max(len(routes) - _max_routes, 0)]:
+        del routes[old_key]
+    _route_cache.save()
+    return assistant_id
\ No newline at end of file
@@ -0,0 +1,82 @@
+import importlib
+import inspect
+import json
+import threading
+from time import perf_counter
+from computer.environment import config, env, logger
+
+_json_types = {
+    str: 'string',
+    int: 'integer',
+    float: 'number',
+    bool: 'boolean',
+    list: 'array',
+    dict: 'object'
+}
+
+def load_function(spec):
+    (module_name, function_name) = spec.split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+def describe_function(spec):
+    function = load_function(spec)
+    properties = {}
+    required = []
+    for name, parameter in inspect.signature(function).parameters.items():
+        if parameter.kind in [parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD]:
+            continue
+        json_type = _json_types.get(parameter.annotation, 'string')
+        properties[name] = {'type': json_type}
+        if parameter.default is parameter.empty:
+            required.append(name)
+    description = inspect.getdoc(function) or ''
+    return {
+        'type': 'function',
+        'function': {
+            'name': function.__name__,
+            'description': description.split('\n\n')[0],
+            'parameters': {'type': 'object', 'properties': properties, 'required': required}
+        }
+    }
+
+def registered_functions():
+    return env.retrieve('tools') or {}
+
+def register_functions(specs):
+    functions = {load_function(spec).__name__: spec for spec in specs}
+    if len(functions) > 0:
+        env.store('tools', {**registered_functions(), **functions})
+
+def _call_function(functions, tool_call):
+    spec = functions.get(tool_call.function.name)
+    if spec is None:
+        logger.debug('Refuse tool call {}: {} is not registered', tool_call.id, tool_call.function.name)
+        return f'Error: function {tool_call.function.name} is not registered on this machine'
+    try:
+        arguments = json.loads(tool_call.function.arguments) if tool_call.function.arguments else {}
+        result = load_function(spec)(**arguments)
+    except Exception as e:
+        logger.debug('Tool call {} failed: {}', tool_call.id, e)
+        return f'Error: {type(e).__name__}: {e}'
+    return result if isinstance(result, str) else json.dumps(result, ensure_ascii=False, default=str)
+
+def run_tool_calls(tool_calls, functions):
+    timeout = config.retrieve_float('tool_timeout', 30.0)
+    outputs = {}
+
+    def call(tool_call):
+        outputs[tool_call.id] = _call_function(functions, tool_call)
+
+    threads = [threading.Thread(target=call, args=(tool_call,), daemon=True) for tool_call in tool_calls]
+    for thread in threads:
+        thread.start()
+    deadline = perf_counter() + timeout
+    for thread in threads:
+        thread.join(max(deadline - perf_counter(), 0))
+
+    tool_outputs = []
+    for tool_call in tool_calls:
+        output = outputs.get(tool_call.id, f'Error: timed out after {timeout:g}s')
+        tool_outputs.append({'tool_call_id': tool_call.id, 'output': output})
+    logger.debug('Tool outputs: {}', tool_outputs)
+    return tool_outputs
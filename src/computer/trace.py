@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+from functools import wraps
+import itertools
+import json
+import re
+import sys
+import threading
+from time import perf_counter, time
+
+_enabled = False
+_started_at = None
+_started = None
+_spans = []
+_span_ids = itertools.count(1)
+_lock = threading.Lock()
+_local = threading.local()
+
+_counters = ['bytes_sent', 'bytes_received', 'requests', 'retries']
+_id_pattern = re.compile(r'^[a-z]+[_-][A-Za-z0-9]{8,}$')
+
+class Span:
+
+    def __init__(self, name, parent, attributes):
+        self.id = next(_span_ids)
+        self.name = name
+        self.parent = parent
+        self.ancestors = (parent.ancestors + [parent]) if parent is not None else []
+        self.thread = threading.current_thread().name
+        self.attributes = dict(attributes)
+        self.counters = dict.fromkeys(_counters, 0)
+        self.start = perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def count(self, **counters):
+        with _lock:
+            for s in [self] + self.ancestors:
+                for name, value in counters.items():
+                    s.counters[name] += value
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = perf_counter() - self.start
+            with _lock:
+                _spans.append(self)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'parent': self.parent.id if self.parent is not None else None,
+            'name': self.name,
+            'thread': self.thread,
+            'start_ms': round((self.start - _started) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3),
+            **self.counters,
+            **self.attributes
+        }
+
+def enable():
+    global _enabled, _started_at, _started
+    with _lock:
+        _enabled = True
+        _started_at = time()
+        _started = perf_counter()
+        _spans.clear()
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def enabled():
+    return _enabled
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def current_span():
+    stack = _stack()
+    return stack[-1] if _enabled and len(stack) > 0 else None
+
+def start_span(name, **attributes):
+    if not _enabled:
+        return None
+    return Span(name, current_span(), attributes)
+
+@contextmanager
+def span(name, **attributes):
+    if not _enabled:
+        yield None
+        return
+    s = start_span(name, **attributes)
+    stack = _stack()
+    stack.append(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=type(e).__name__)
+        raise
+    finally:
+        stack.pop()
+        s.finish()
+
+def traced(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def request_name(method, path):
+    segments = ['{id}' if _id_pattern.match(segment) else segment for segment in path.split('/')]
+    return f'http {method} {"/".join(segments)}'
+
+def spans():
+    with _lock:
+        return sorted(_spans, key=lambda s: s.start)
+
+def _phases():
+    phases = {}
+    paths = {}
+    for s in spans():
+        parent_path = paths.get(s.parent.id, ()) if s.parent is not None else ()
+        path = paths[s.id] = parent_path + (s.name,)
+        phase = phases.setdefault(path, {'start': s.start, 'count': 0, 'duration': 0.0, **dict.fromkeys(_counters, 0)})
+        phase['count'] += 1
+        phase['duration'] += s.duration
+        for name in _counters:
+            phase[name] += s.counters[name]
+    order = lambda path: [phases[path[:depth]]['start'] for depth in range(1, len(path) + 1)]
+    return [(path, phases[path]) for path in sorted(phases, key=order)]
+
+def _format_bytes(size):
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024 or unit == 'MB':
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+
+def print_report(file=None):
+    file = sys.stderr if file is None else file
+    total = perf_counter() - _started
+    print(f'{"phase":<48} {"count":>5} {"total":>10} {"mean":>10} {"sent":>9} {"received":>9} {"retries":>7}', file=file)
+    for path, phase in _phases():
+        label = ('  ' * (len(path) - 1) + path[-1])[:48]
+        total_ms = phase['duration'] * 1000
+        mean_ms = total_ms / phase['count']
+        print(f'{label:<48} {phase["count"]:>5} {total_ms:>8.1f}ms {mean_ms:>8.1f}ms {_format_bytes(phase["bytes_sent"]):>9} {_format_bytes(phase["bytes_received"]):>9} {phase["retries"]:>7}', file=file)
+    print(f'{"total":<48} {"":>5} {total * 1000:>8.1f}ms', file=file)
+
+def export(path, argv):
+    trace = {
+        'command': argv,
+        'started_at': _started_at,
+        'duration_ms': round((perf_counter() - _started) * 1000, 3),
+        'spans': [s.to_dict() for s in spans()]
+    }
+    with open(path, 'w') as f:
+        json.dump(trace, f, ensure_ascii=False)
@@ -0,0 +1,93 @@
+import fcntl
+import json
+import os
+import struct
+import uuid
+from computer.environment import env, logger
+
+_offset_format = '<Q'
+_offset_size = struct.calcsize(_offset_format)
+
+class Transcript:
+
+    def __init__(self, id):
+        self.id = id
+        self._directory = f'{env.data_dir()}/transcripts'
+        self._path = f'{self._directory}/{id}.jsonl'
+        self._index_path = f'{self._directory}/{id}.idx'
+
+    @classmethod
+    def create(cls):
+        return cls(uuid.uuid4().hex)
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self._index_path) // _offset_size
+        except FileNotFoundError:
+            return 0
+
+    def _offset(self, index, position):
+        index.seek(position * _offset_size)
+        return struct.unpack(_offset_format, index.read(_offset_size))[0]
+
+    def _repair(self, f, index):
+        size = f.seek(0, os.SEEK_END)
+        count = index.seek(0, os.SEEK_END) // _offset_size
+        while count > 0 and self._offset(index, count - 1) >= size:
+            count -= 1
+        index.truncate(count * _offset_size)
+
+        start = self._offset(index, count - 1) if count > 0 else 0
+        f.seek(start)
+        tail = f.read()
+        end = tail.rfind(b'\n') + 1
+        if end < len(tail):
+            f.truncate(start + end)
+        starts = [start] if count == 0 and end > 0 else []
+        newline = tail.find(b'\n')
+        while 0 <= newline < end - 1:
+            starts.append(start + newline + 1)
+            newline = tail.find(b'\n', newline + 1)
+        if len(starts) > 0:
+            logger.debug('Reindex {} messages of transcript {}', len(starts), self.id)
+            index.write(b''.join(struct.pack(_offset_format, offset) for offset in starts))
+        return start + end
+
+    def append(self, messages):
+        os.makedirs(self._directory, exist_ok=True)
+        with open(self._path, 'ab+') as f, open(self._index_path, 'ab+') as index:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                offset = self._repair(f, index)
+                lines = []
+                offsets = []
+                for message in messages:
+                    line = json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n'
+                    offsets.append(offset)
+                    offset += len(line)
+                    lines.append(line)
+                f.write(b''.join(lines))
+                f.flush()
+                index.write(b''.join(struct.pack(_offset_format, offset) for offset in offsets))
+                index.flush()
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def read(self, start=0, stop=None):
+        count = len(self)
+        start = max(start, 0)
+        stop = count if stop is None else min(stop, count)
+        if start >= stop:
+            return []
+        with open(self._index_path, 'rb') as index, open(self._path, 'rb') as f:
+            begin = self._offset(index, start)
+            f.seek(begin)
+            data = f.read(self._offset(index, stop) - begin) if stop < count else f.read()
+        return [json.loads(line) for line in data.split(b'\n')[:stop - start]]
+
+    def remove(self):
+        for path in [self._path, self._index_path]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -1,41 +1,157 @@
 import re
 import sys
-import openai
-from computer.environment import env, logger
+from time import time
+from computer.cache import Cache
+from computer.client import get_client
+from computer.environment import config, env, logger
+from computer.index import NameIndex
+from computer.lazy import lazy_import
+from computer.trace import span, traced
 
-def get_all_files(purpose=openai._types.NotGiven):
-    files = openai.files.list(purpose=purpose)
-    logger.debug(f'Get all files: {files}')
+openai = lazy_import('openai')
+
+_filename_cache = Cache('filenames')
+_metadata_cache = Cache('metadata')
+_metadata_objects = {}
+_metadata_indexes = {}
+_purpose_files = {}
+
+def _list_page_size():
+    return int(min(max(config.retrieve_float('list_page_size', 100), 1), 100))
+
+def _load_metadata(name, model, list_function, refresh=False):
+    entry = _metadata_cache.get(name)
+    ttl = config.retrieve_float('metadata_cache_ttl', 600.0)
+    if not refresh and entry is not None and time() - entry['stored_at'] < ttl:
+        if name in _metadata_objects and _metadata_objects[name][0] == entry['stored_at']:
+            return _metadata_objects[name][1]
+        with span(f'load {name}', cached=True):
+            logger.debug('Load {} from cache', name)
+            objects = [model.construct(**data) for data in entry['data']]
+    else:
+        with span(f'load {name}', cached=False):
+            objects = list(list_function())
+            entry = {'stored_at': time(), 'data': [o.model_dump(mode='json') for o in objects]}
+            _metadata_cache.set(name, entry)
+            _metadata_cache.save()
+    _metadata_objects[name] = (entry['stored_at'], objects)
+    return objects
+
+def _get_index(name, objects, name_function):
+    if name not in _metadata_indexes or _metadata_indexes[name][0] is not objects:
+        _metadata_indexes[name] = (objects, NameIndex(objects, name_function))
+    return _metadata_indexes[name][1]
+
+def _update_metadata(name, added=None, removed_id=None):
+    entry = _metadata_cache.get(name)
+    if entry is None:
+        return
+    removed_ids = [removed_id, added.id if added else None]
+    entry['data'] = [data for data in entry['data'] if data['id'] not in removed_ids]
+    if added:
+        entry['data'].insert(0, added.model_dump(mode='json'))
+    entry['stored_at'] = time()
+    _metadata_cache.set(name, entry)
+    _metadata_cache.save()
+    _metadata_objects.pop(name, None)
+
+def invalidate_metadata_cache():
+    _metadata_cache.clear()
+    _metadata_objects.clear()
+
+def update_file_cache(added=None, removed_id=None):
+    _update_metadata('files', added=added, removed_id=removed_id)
+
+def update_assistant_cache(added=None, removed_id=None):
+    _update_metadata('assistants', added=added, removed_id=removed_id)
+
+def get_all_files(purpose=None, refresh=False):
+    files = _load_metadata('files', openai.types.FileObject, lambda: get_client().files.list(), refresh=refresh)
+    if purpose is not None:
+        if purpose not in _purpose_files or _purpose_files[purpose][0] is not files:
+            _purpose_files[purpose] = (files, [f for f in files if f.purpose == purpose])
+        files = _purpose_files[purpose][1]
+    logger.debug('Get all files: {}', files)
     return files
 
-def get_file_ids_from_names(filenames, purpose=openai._types.NotGiven):
-    files = get_all_files(purpose=purpose)
+def get_file_index(purpose=None, refresh=False):
+    files = get_all_files(purpose=purpose, refresh=refresh)
+    return _get_index(f'files:{purpose}', files, lambda f: f.filename)
+
+def get_file_ids_from_names(filenames, purpose=None):
+    index = get_file_index(purpose=purpose)
     file_ids = []
     all_matched = True
     for filename in filenames:
-        for file_data in files.data:
-            if filename in file_data.filename:
-                file_ids.append(file_data.id)
-                break
+        matched_ids = index.substring(filename)
+        if len(matched_ids) > 0:
+            file_ids.append(matched_ids[0])
         else:
             file_ids.append(None)
             all_matched = False
-    logger.debug(f'Get file IDs from names: {file_ids}; {all_matched}; {filenames}')
+    logger.debug('Get file IDs from names: {}; {}; {}', file_ids, all_matched, filenames)
     return (file_ids, all_matched)
 
-def get_all_assistants():
-    assistants = openai.beta.assistants.list()
-    logger.debug(f'Get all assistants: {assistants}')
+@traced('resolve file names')
+def get_filenames_from_ids(file_ids):
+    filenames = {file_id: _filename_cache.get(file_id) for file_id in set(file_ids)}
+    missing_ids = [file_id for file_id, filename in filenames.items() if filename is None]
+    if len(missing_ids) > 0:
+        files = get_all_files(refresh=True)
+        _filename_cache.update({file_data.id: file_data.filename for file_data in files})
+        # False marks ids absent from the listing, such as deleted files, so they are not listed again
+        _filename_cache.update({file_id: False for file_id in missing_ids if _filename_cache.get(file_id) is None})
+        _filename_cache.save()
+        for file_id in missing_ids:
+            filenames[file_id] = _filename_cache.get(file_id)
+    filenames = {file_id: filename if filename is not False else None for file_id, filename in filenames.items()}
+    logger.debug('Get filenames from IDs: {}; missing {}', filenames, missing_ids)
+    return filenames
+
+def get_all_assistants(refresh=False):
+    assistants = _load_metadata('assistants', openai.types.beta.Assistant, lambda: get_client().beta.assistants.list(limit=_list_page_size()), refresh=refresh)
+    logger.debug('Get all assistants: {}', assistants)
     return assistants
 
-def get_assistant_ids_from_names(assistant_names, strict=False):
-    assistants = get_all_assistants()
+def get_assistant_index(refresh=False):
+    assistants = get_all_assistants(refresh=refresh)
+    return _get_index('assistants', assistants, lambda a: a.name)
+
+def get_assistant_id_index(refresh=False):
+    assistants = get_all_assistants(refresh=refresh)
+    return _get_index('assistants:id', assistants, lambda a: a.id)
+
+def get_assistant_ids_from_names(assistant_names, strict=False, refresh=False):
+    index = get_assistant_index(refresh=refresh)
     assistant_ids = []
     for assistant_name in assistant_names:
-        matched_ids = []
-        for assistant_data in assistants.data:
-            if (strict and assistant_name == assistant_data.name) or (not strict and assistant_name in assistant_data.name) or (assistant_name == assistant_data.id):
-                matched_ids.append(assistant_data.id)
+        if strict:
+            matched_ids = index.exact(assistant_name)
+        else:
+            matched_ids = index.substring(assistant_name)
+        if index.get(assistant_name) and assistant_name not in matched_ids:
+            matched_ids.append(assistant_name)
         assistant_ids.append(matched_ids)
-    logger.debug(f'Get assistant IDs from names: {assistant_ids}; {assistant_names}')
-    return assistant_ids
\ No newline at end of file
+    logger.debug('Get assistant IDs from names: {}; {}', assistant_ids, assistant_names)
+    if not refresh and any(len(matched_ids) == 0 for matched_ids in assistant_ids):
+        return get_assistant_ids_from_names(assistant_names, strict=strict, refresh=True)
+    return assistant_ids
+
+@traced('sync thread messages')
+def get_thread_messages(thread_id):
+    thread_cache = Cache(f'threads/{thread_id}')
+    cached_messages = thread_cache.get('messages') or []
+    last_id = cached_messages[-1]['id'] if len(cached_messages) > 0 else openai.NOT_GIVEN
+    thread_messages = list(get_client().beta.threads.messages.list(thread_id, order='asc', after=last_id, limit=_list_page_size()))
+    logger.debug('List thread messages after {}: {}', last_id, thread_messages)
+
+    messages = [openai.types.beta.threads.Message.construct(**data) for data in cached_messages] + thread_messages
+    completed_messages = []
+    for thread_message in thread_messages:
+        if thread_message.status not in [None, 'completed']:
+            break
+        completed_messages.append(thread_message.model_dump(mode='json'))
+    if len(completed_messages) > 0:
+        thread_cache.set('messages', cached_messages + completed_messages)
+        thread_cache.save()
+    return messages
\ No newline at end of file